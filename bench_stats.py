@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''Benchmark the single-pass word statistics (m750.analyse_tokens and the
+lexicon matcher) against the old scan, which went over the words once for
+each statistic and looked every word up every time it occurred.
+
+    python bench_stats.py -P ~/Downloads
+
+The Moby data is loaded before anything is timed.
+
+'''
+import argparse
+import sys
+import time
+
+import m750
+
+
+def old_scan(text, use_moby=True, wordfunc=None):
+    '''The per-word statistics as stats used to calculate them.'''
+    if wordfunc is None:
+        wordfunc = lambda x: x
+    lwords = [w.lower() for w in text.split()]
+    word_lengths = [len(w) for w in lwords]
+    wdict = m750.freqdict(text, wordfunc=wordfunc)
+    swearing = 0
+    for word in lwords:
+        for swearword in m750.swearwords:
+            if swearword in word:
+                swearing += 1
+    results = {'lwords': lwords, 'word_lengths': word_lengths,
+               'freqdict': wdict, 'swearing': swearing}
+    if use_moby:
+        import moby
+        results['syllable_lengths'] = [len(moby.syllables[w]) for w in
+                                       lwords if w in moby.syllables]
+        poses = {}
+        for pos in moby.postypes.values():
+            poses[pos] = 0
+            for word in lwords:
+                try:
+                    for wpos in moby.pos[word]:
+                        poses[wpos] += 1
+                except KeyError:
+                    continue
+        results['pos'] = poses
+    return results
+
+
+def new_scan(text, use_moby=True, wordfunc=None):
+    '''The per-word statistics as stats calculates them now.'''
+    results = m750.analyse_tokens(text, wordfunc=wordfunc)
+    if use_moby:
+        results['syllable_lengths'] = m750.syllable_lengths(results['lwords'])
+        results['pos'] = m750.pos_counts(results['lwords'])
+    return results
+
+
+def old_lexicon_counts(lwords):
+    '''Count the swear words the old way, checking every word for every
+    one of them.'''
+    count = 0
+    for word in lwords:
+        for swearword in m750.swearwords:
+            if swearword in word:
+                count += 1
+    return count
+
+
+def new_lexicon_counts(lwords):
+    '''Count the swear words with the lexicon matcher, as analyse_tokens
+    does.'''
+    matcher = m750.get_lexicon_matcher([('swearing', m750.swearwords)])
+    lookups = {}
+    count = 0
+    for word in lwords:
+        if not word in lookups:
+            lookups[word] = matcher.counts(word).get(0, 0)
+        count += lookups[word]
+    return count
+
+
+def best_time(func, args, repeat):
+    '''Return the shortest time taken by ``func(*args)`` out of *repeat*
+    runs, and its result.'''
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def report(label, old, new):
+    print '%-28s old %8.3f s   new %8.3f s   %6.1fx' % (label, old, new, old / max(new, 1e-9))
+
+
+def main():
+    parser = get_cmdline_parser()
+    args = parser.parse_args(sys.argv[1:])
+    use_moby = not args.no_moby
+    if use_moby:
+        import moby
+        moby.preload(('syllables', 'pos'))
+    text, entries = m750.read_local_750words(args.path)
+    if not entries:
+        parser.error('no export files found in %s' % args.path)
+    texts = [m750.clean_for_stats(e['text']) for e in entries]
+    alltext = '\n'.join(texts)
+    lwords = [w.lower() for w in alltext.split()]
+    print '%d entries, %d words' % (len(entries), len(lwords))
+
+    old, old_count = best_time(old_lexicon_counts, (lwords, ), args.repeat)
+    new, new_count = best_time(new_lexicon_counts, (lwords, ), args.repeat)
+    assert old_count == new_count
+    report('swear words', old, new)
+
+    old, old_results = best_time(old_scan, (alltext, use_moby), args.repeat)
+    new, new_results = best_time(new_scan, (alltext, use_moby), args.repeat)
+    # The old parts of speech counts were wrong (each word was counted once
+    # for every part of speech), so they aren't compared.
+    for key in ('lwords', 'word_lengths', 'freqdict', 'swearing', 'syllable_lengths'):
+        assert old_results.get(key) == new_results.get(key), key
+    report('all words at once', old, new)
+
+    old, results = best_time(lambda: [old_scan(t, use_moby) for t in texts], (), args.repeat)
+    new, results = best_time(lambda: [new_scan(t, use_moby) for t in texts], (), args.repeat)
+    report('one entry at a time', old, new)
+
+
+def get_cmdline_parser():
+    parser = argparse.ArgumentParser('benchmark the word statistics')
+    parser.add_argument('-P', '--path', default=m750.DEFAULT_PATH,
+                        help='folder containing the export files')
+    parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help='number of times to run each benchmark (the best is shown)')
+    parser.add_argument('--no-moby', action='store_true',
+                        help="don't include the syllables and parts of speech")
+    return parser
+
+
+if __name__ == '__main__':
+    main()
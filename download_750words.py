@@ -13,7 +13,9 @@ def main():
         dl_current = False
     else:
         dl_current = True
-    text, entries = m750.download_750words(email=args.username, password=args.password, current=dl_current, download=args.path)
+    text, entries = m750.download_750words(email=args.username, password=args.password, current=dl_current, download=args.path,
+                                           refresh=args.refresh, rate=float(args.rate),
+                                           workers=int(args.workers))
     
     
 def get_cmdline_parser():
@@ -23,9 +25,26 @@ def get_cmdline_parser():
                         help='where to download to')
     parser.add_argument('-a', '--all', action='store_true',
                         help='download all months (default is only the current month)')
+    parser.add_argument('-r', '--refresh', action='store_true',
+                        help='with --all, download months already in the path again')
+    parser.add_argument('--rate', default='0.1',
+                        help='most export requests per second (default one every 10 s)')
+    parser.add_argument('--workers', default='2', type=positive_int,
+                        help='number of months to download at once')
     parser.add_argument("-u", "--username", default=None)
     parser.add_argument("-p", "--password", default=None)
     return parser    
+
+
+def positive_int(value):
+    '''Argument type for numbers of things, which must be at least 1.'''
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('%r is not a whole number' % value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('%r is less than 1' % value)
+    return number
     
     
 if __name__ == '__main__':
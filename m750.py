@@ -7,6 +7,19 @@ To read data from your downloads folder (``DEFAULT_PATH`` set in this file)::
 
     >>> text, entries = read_local_750words()
 
+To go through the entries one at a time instead, without reading all your
+writing into memory at once::
+
+    >>> for entry in iter_entries():
+    ...     print entry['date'], entry['words']
+
+If you keep a session open, an ``archive`` only re-reads the months which have
+changed since you last looked::
+
+    >>> a = archive()
+    >>> a.update()                      # e.g. ['2013-02']
+    >>> estats = a.entrystats()         # only recalculated for Feb 2013
+
 Or to download directly from https://www.750words.com::
 
     >>> text, entries = download_750words()
@@ -56,15 +69,29 @@ data if you use ``use_moby=True``.
 '''
 from __future__ import division
 
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
+import bisect
 import codecs
 import datetime
-import glob
+import hashlib
+import heapq
+import math
+import mmap
+import numbers
 import os
 import re
+import struct
 import sys
+import tempfile
+import threading
 import time
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 try:
     import matplotlib.pyplot as plt
 except ImportError:
@@ -73,6 +100,31 @@ except ImportError:
 
 DEFAULT_PATH = os.path.normpath(os.path.expanduser('~/Downloads'))
 
+BASE_URL = 'https://750words.com'
+
+# The ETag and Last-Modified headers of downloaded exports are kept in this
+# file (in the export folder), for conditional requests (see export_fetcher).
+DOWNLOAD_STATE_FN = '.m750-download.pickle'
+
+# Parsed export files are cached in this folder so that only new or changed
+# months need to be parsed again, with a file for each export folder and
+# parse function (see default_cache_fn). Bump CACHE_VERSION whenever
+# parse_markdown changes what it returns.
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                         os.path.expanduser('~/.cache'), 'm750')
+CACHE_VERSION = 3
+
+# Corpus index files (see write_corpus) start with CORPUS_MAGIC and the
+# CORPUS_SOURCE_SIZE bytes identifying what the entries were read from,
+# followed by a record for each entry: date (ordinal), position, length,
+# words, minutes.
+CORPUS_MAGIC = 'M750IDX2'
+CORPUS_SOURCE_SIZE = 32
+CORPUS_RECORD = '<iqiii'
+
+# Bits used for each word's id in the integer keys of ngramcounts.
+NGRAM_BITS = 21
+
 # Don't want to measure contractions like etc. vs et cetera, etc.?
 substitutions = {"it's": 'it is'}
 
@@ -98,25 +150,253 @@ ratios = [('The', 'The', ('The', 'the')),
 
 swearwords = ['fuck', 'shit', 'crap', 'bugger']
 
+# Lexicons of words to count in the text. For each (label, words) pair, stats
+# has an attribute *label* with the number of words in the text which contain
+# one of *words*, counting each of *words* found in a word once. For example::
+#
+#   lexicons = [('swearing', swearwords),
+#               ('coffee', ('coffee', 'espresso', 'latte'))]
+#
+# All the lexicons are searched together, so adding lexicons (or words to a
+# lexicon) doesn't slow the stats down noticeably.
+lexicons = [('swearing', swearwords)]
 
-def read_local_750words(path=DEFAULT_PATH):
+
+def read_local_750words(path=DEFAULT_PATH, cache=True, corpus_fn=None,
+                        parsed=None):
     '''Read 750 words entries from local download files.
 
+    Args:
+        - *path*: folder containing the export files
+        - *cache*: if True, keep the parsed entries in a file in
+          ``CACHE_DIR`` (see default_cache_fn) so only new or changed export
+          files are parsed next time. Can also be the filename to use for
+          the cache, or False to parse everything from scratch.
+        - *corpus_fn*: if given, also write all the entries to this corpus
+          file (see write_corpus and corpus_file). It is only written again
+          when the export files have changed.
+        - *parsed*: as for update_manifest
+
     Returns: *clean_md, entries*
         - *clean_md*: cleaned Markdown file of all entries.
         - *entries*: a list of dictionaries for each entry
 
     '''
-    rawtext = ''
-    for fn in find_export_files(path):
-        with open(fn, mode='r') as f:
-            rawtext += f.read()
-    return parse_markdown(rawtext)
+    if cache is True:
+        cache = default_cache_fn(path)
+    items, changed = update_manifest(find_export_files(path), cache_fn=cache,
+                                     parsed=parsed)
+    entries = [e for item in items for e in item['entries']]
+    if corpus_fn:
+        # Identify the export files by their contents rather than relying on
+        # *changed*, which is empty if something else updated the cache.
+        source = hashlib.md5(' '.join(item['md5'] for item in items)).hexdigest()
+        if corpus_source(corpus_fn) != source:
+            write_corpus(entries, corpus_fn, source=source)
+    return '\n'.join(item['clean_md'] for item in items), entries
+
+
+def parse_export_files(fns, cache_fn=None, parse_func=None, parsed=None):
+    '''Parse export files one by one, re-using cached results if possible.
+
+    Args:
+        - *fns*: list of export filenames, in date order
+        - *cache_fn*: filename of the cache, or None to not use one
+        - *parse_func*: function to parse the text of each file with,
+          defaults to parse_markdown
+        - *parsed*: as for update_manifest
+
+    Returns: *clean_md, entries* (see parse_markdown)
+
+    '''
+    items, changed = update_manifest(fns, cache_fn=cache_fn, parse_func=parse_func,
+                                     parsed=parsed)
+    entries = []
+    for item in items:
+        entries += item['entries']
+    return '\n'.join(item['clean_md'] for item in items), entries
+
+
+def update_manifest(fns, cache_fn=None, parse_func=None, parsed=None):
+    '''Bring the manifest of parsed export files in *cache_fn* up to date.
+
+    Each export file is recorded with its size, modification time and MD5
+    hash, along with its parsed *clean_md* and *entries*, the number of
+    entries *n_entries*, and the word count of each entry *nwords*. A file is
+    only read again if its size or modification time has changed, and only
+    parsed again if its contents have changed.
+
+    Args: as for parse_export_files, and
+        - *parsed*: dictionary of absolute filename -> manifest dictionary
+          (see parse_export_file) for files which have already been parsed,
+          e.g. as they were downloaded. These are used instead of reading
+          the files again, as long as the files haven't changed since.
+
+    Returns: *items, changed*
+        - *items*: list of manifest dictionaries, one for each of *fns*
+        - *changed*: list of filenames in *fns* whose contents are new or
+          have changed since the manifest was last updated
+
+    '''
+    if parse_func is None:
+        parse_func = parse_markdown
+    if parsed is None:
+        parsed = {}
+    cached = {}
+    if cache_fn:
+        cached = load_cache(cache_fn, parse_func)
+    manifest = {}
+    items = []
+    changed = []
+    modified = False
+    for fn in fns:
+        st = os.stat(fn)
+        key = os.path.abspath(fn)
+        item = cached.get(key)
+        if item is None or item['size'] != st.st_size or item['mtime'] != st.st_mtime:
+            new = parsed.get(key)
+            if new is None or new['size'] != st.st_size or new['mtime'] != st.st_mtime:
+                new = parse_export_file(fn, parse_func, previous=item)
+            if item is None or item['md5'] != new['md5']:
+                changed.append(fn)
+            item = new
+            modified = True
+        manifest[key] = item
+        items.append(item)
+    if cache_fn and (modified or len(manifest) != len(cached)):
+        save_cache(manifest, cache_fn, parse_func)
+    return items, changed
+
+
+def parse_export_file(fn, parse_func=None, previous=None):
+    '''Read and parse one export file.
+
+    Args:
+        - *fn*: export filename
+        - *parse_func*: as for parse_export_files
+        - *previous*: the file's last manifest dictionary, if any; if the
+          file's contents haven't changed, it is updated and returned
+          rather than parsing the file again
+
+    Returns: the file's manifest dictionary (see update_manifest)
+
+    '''
+    if parse_func is None:
+        parse_func = parse_markdown
+    st = os.stat(fn)
+    with open(fn, mode='r') as f:
+        text = f.read()
+    md5 = hashlib.md5(text).hexdigest()
+    if previous is not None and previous['md5'] == md5:
+        item = previous
+    else:
+        clean_md, entries = parse_func(text)
+        item = {'clean_md': clean_md, 'entries': entries,
+                'n_entries': len(entries),
+                'nwords': [count_words(e['text']) for e in entries]}
+    item.update({'fn': fn, 'size': st.st_size, 'mtime': st.st_mtime,
+                 'md5': md5})
+    return item
+
+
+def default_cache_fn(path, parse_func=None):
+    '''Return the filename of the cache for the export files in *path*
+    parsed with *parse_func* (default parse_markdown).
+
+    Each export folder and parse function has its own file in ``CACHE_DIR``,
+    so nothing is written to the export folder, and programs which parse the
+    export files differently (such as view750) don't share a cache.
+
+    '''
+    key = '%s %s' % (os.path.abspath(path), parser_name(parse_func))
+    return os.path.join(CACHE_DIR, hashlib.md5(key).hexdigest() + '.pickle')
+
+
+def parser_name(parse_func=None):
+    '''Return the name identifying *parse_func* (default parse_markdown) in
+    caches of parsed export files.'''
+    if parse_func is None:
+        parse_func = parse_markdown
+    return '%s.%s' % (parse_func.__module__, parse_func.__name__)
+
+
+def load_cache(cache_fn, parse_func=None):
+    '''Return the dictionary of export files parsed with *parse_func*
+    stored in *cache_fn*, or an empty dictionary if there is no usable
+    cache.'''
+    try:
+        with open(cache_fn, mode='rb') as f:
+            version, parser, files = pickle.load(f)
+    except Exception:
+        return {}
+    if version != CACHE_VERSION or parser != parser_name(parse_func):
+        return {}
+    return files
+
+
+def save_cache(files, cache_fn, parse_func=None):
+    '''Write the dictionary of export files parsed with *parse_func* to
+    *cache_fn*, creating its folder if necessary.'''
+    try:
+        folder = os.path.dirname(cache_fn)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        save_pickle((CACHE_VERSION, parser_name(parse_func), files), cache_fn)
+    except (IOError, OSError) as e:
+        print 'Warning: could not write cache %s (%s)' % (cache_fn, e)
+
+
+def save_pickle(obj, fn):
+    '''Pickle *obj* to the file *fn*.
+
+    The pickle is written to a new temporary file next to *fn* first, so an
+    interrupted write never leaves a broken file behind, and processes
+    writing *fn* at the same time don't write over each other's temporary
+    files.
+
+    '''
+    fd, tmp_fn = tempfile.mkstemp(prefix=os.path.basename(fn) + '.',
+                                  suffix='.tmp', dir=os.path.dirname(fn) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        try:
+            os.rename(tmp_fn, fn)
+        except OSError:
+            # Windows won't rename over an existing file.
+            os.remove(fn)
+            os.rename(tmp_fn, fn)
+    except:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+
+
+def iter_entries(path=DEFAULT_PATH):
+    '''Iterate over 750 words entries in local download files.
+
+    The export files are read line by line, and each entry is yielded as
+    soon as it is complete, so the text of all your writing never has to be
+    in memory at once. The entries are the same dictionaries as those
+    returned by read_local_750words, and can be passed straight to
+    stats_750, entrystats or paragraphs::
+
+        >>> s750 = stats_750(iter_entries())
+
+    '''
+    def iter_lines(fns):
+        for fn in fns:
+            with open(fn, mode='rU') as f:
+                for line in f:
+                    yield line.rstrip('\n')
+
+    return iter_markdown_entries(iter_lines(find_export_files(path)))
 
 
 
 def download_750words(email=None, password=None, download='default_path',
-                      current=True):
+                      current=True, refresh=False, base_url=BASE_URL,
+                      rate=0.1, workers=2):
     '''Download 750 words entries from 750words.com
 
     Args:
@@ -128,6 +408,16 @@ def download_750words(email=None, password=None, download='default_path',
           True by default because you should only need to have this ``False`` to
           download all data ONCE, given the inability to change old content on
           750words.com -- please be easy on Buster's servers! :-)
+          With ``current=False``, only the months which aren't already in
+          *download* (and the current month) are downloaded; see
+          plan_downloads.
+        - *refresh*: with ``current=False``, download every month again,
+          even those already on disk.
+        - *base_url*: address of the 750 words site
+        - *rate*: with ``current=False``, the most export requests to make
+          per second, on average (see export_fetcher)
+        - *workers*: with ``current=False``, number of downloads to run at
+          once
 
     Returns: *clean_md, entries*
         - *clean_md*: cleaned Markdown file of all entries.
@@ -163,7 +453,7 @@ def download_750words(email=None, password=None, download='default_path',
 
     print 'Logging in to 750words.com with email=%s password=****...' % email
     session = requests.Session()
-    r = session.post('https://750words.com/auth/signin', data={
+    r = session.post(base_url + '/auth/signin', data={
                             'person[email_address]': email,
                             'person[password]': password})
     if not 'THIS MONTH' in r.text:
@@ -173,7 +463,7 @@ def download_750words(email=None, password=None, download='default_path',
         today = datetime.datetime.now()
         year = today.year
         month = today.month
-        r = session.get('https://750words.com/export/%s/%s' % (year, month))
+        r = session.get(base_url + '/export/%s/%s' % (year, month))
         if download:
             write_file(r.text, year, month, path)
             return read_local_750words(path)
@@ -182,29 +472,42 @@ def download_750words(email=None, password=None, download='default_path',
                   'read in only the current month\'s writing.')
             return parse_markdown(r.text)
     else:
-        urls = get_all_urls(session)
-        months = []
-        N = len(urls)
-        for n, url in enumerate(urls):
-            print 'Downloading %s... [%d of %d]' % (url, n + 1, N)
-            year, month = map(int, url.split('/')[-2:])
-            text = session.get(url).text
+        urls = get_all_urls(session, base_url)
+        if download and not refresh:
+            urls = plan_downloads(urls, path)
+        print 'Downloading %d months...' % len(urls)
+        fetcher = export_fetcher(session, path=path if download else None,
+                                 rate=rate, workers=workers)
+        months = {}
+        parsed = {}
+        for year, month, text in fetcher.fetch(urls):
+            # Parse each month while the others are still downloading.
             if download:
-                write_file(text, year, month, path)
-            months.append([year, month, text])
-            time.sleep(10)       # 10 seconds between export requests
+                fn = export_filename(year, month, path)
+                parsed[os.path.abspath(fn)] = parse_export_file(fn)
+            else:
+                months[(year, month)] = parse_markdown(text)
+        if fetcher.failed:
+            print 'Warning: %d months could not be downloaded' % len(fetcher.failed)
 
-        all_text = ''
-        for year, month, text in months:
-            all_text += text + '\n \n'
-        return parse_markdown(all_text)
+        if download:
+            # Only the months which weren't just downloaded are read here.
+            return read_local_750words(path, parsed=parsed)
+        parsed = [months[key] for key in sorted(months)]
+        return ('\n'.join(clean_md for clean_md, entries in parsed),
+                [e for clean_md, entries in parsed for e in entries])
 
 
 class stats_750(dict):
     '''Performance in the context of the 750 words website.
 
     Args:
-        - *entries*: a list of dictionaries for each entry (see other functions)
+        - *entries*: a list of dictionaries for each entry (see other functions),
+          an iterator over them such as iter_entries(), or an entry_table
+        - *nwords*: optional list of the number of words in each entry, if
+          already known (e.g. from update_manifest), to save counting them
+        - *recount*: count the words in each entry's text (the default). If
+          False, use the word count recorded in the export file instead.
 
     Attributes: 
         - Lists of values for each entry:
@@ -220,57 +523,31 @@ class stats_750(dict):
         - *plot_history*
 
     '''
-    def __init__(self, entries, verbose=0):
+    def __init__(self, entries, verbose=0, nwords=None, recount=True):
         self.__dict__ = self
         self.entries = entries
-        self.dates = [e['date'] for e in entries]
-        self.nwords = [count_words(e['text']) for e in entries]
+        self.dates = []
+        if isinstance(entries, entry_table):
+            self.dates = entries.dates()
+            if nwords is None:
+                if recount:
+                    nwords = [count_words(entries.text(i)) for i in range(len(entries))]
+                else:
+                    nwords = entries.words
+            self.nwords = list(nwords)
+        elif nwords is None:
+            self.nwords = []
+            for e in entries:
+                self.dates.append(e['date'])
+                if recount:
+                    self.nwords.append(count_words(e['text']))
+                else:
+                    self.nwords.append(e['words'])
+        else:
+            self.dates = [e['date'] for e in entries]
+            self.nwords = list(nwords)
         self.successes = [True if n > 750 else False for n in self.nwords]
-        
-        streaks = []
-        consecs = []
-        streak = 0
-        start = self.dates[0]
-        for i, reached_750 in enumerate(self.successes):
-            consecutive = 0
-            if i > 0:
-                consecutive = 1
-                if self.dates[i] - self.dates[i - 1] != datetime.timedelta(hours=24):
-                    consecutive = 0
-            consecs.append(consecutive)
-            
-            # you can't have a streak if this entry's date does not follow on from the previous date
-            if not consecutive:
-                if streak > 0:
-                    streaks.append([streak, start, self.dates[i - 1]])
-                streak = 0
-            
-            # if you reached 750 words and aren't on a streak, you have started one
-            if reached_750 and streak == 0:
-                start = self.dates[i]
-            
-            # no streak yet, and you reached 750 words
-            if not streak and reached_750:
-                streak += 1
-                continue
-                
-            # there is a streak, and you reached 750 words, and you didn't skip a day
-            if streak and reached_750 and consecutive:
-                streak += 1
-                continue
-                
-            # there is a streak, and you failed to reach 750 OR you skipped a day
-            if streak and (not reached_750 or not consecutive):
-                streaks.append([streak, start, self.dates[i - 1]])
-                streak = 0
-                continue
-        
-        # you are on a streak as of the last day
-        if streak > 0:
-            streaks.append([streak, start, self.dates[-1]])
-            
-        self.streaks = streaks
-        self.consecs = consecs
+        self.consecs, self.streaks = find_streaks(self.dates, self.successes)
         
     def plot_entry_lengths(self, **kwargs):
         try:
@@ -304,7 +581,7 @@ class stats_750(dict):
     def __str__(self):
         st = []
         s = []
-        s.append('Number of entries: %d' % len(self.entries))
+        s.append('Number of entries: %d' % len(self.dates))
         for ndays, start, end in sorted(self.streaks, reverse=True, ):
             st.append('%d (%s' % (ndays, start.strftime('%d/%m/%y')))
             if end - start >= datetime.timedelta(hours=24):
@@ -317,16 +594,472 @@ class stats_750(dict):
 
 
 
+class entry_table(object):
+    '''Entries stored column by column, which takes much less memory than
+    a list of dictionaries.
+
+    The dates, word counts and minutes are kept in arrays, and the text of
+    all the entries in one string. Indexing or iterating over the table gives
+    entry_row objects, which can be used like the entry dictionaries, so the
+    table can be passed anywhere a list of entries can (e.g. stats_750,
+    entrystats, paragraphs, metalist)::
+
+        >>> table = entry_table(iter_entries())
+        >>> s750 = stats_750(table)
+
+    Args:
+        - *entries*: a list of dictionaries for each entry, or an iterator
+          over them such as iter_entries()
+
+    Attributes:
+        - *days*: array of the date of each entry, as the day number
+          returned by datetime.toordinal
+        - *words*: array of the word count recorded for each entry
+        - *mins*: array of the minutes recorded for each entry
+        - *buffer*: string of the text of all the entries
+        - *offsets*: array of where each entry's text starts in *buffer*,
+          plus the end of the last one
+        - *metadata*: dictionary of entry number -> metadata dictionary, for
+          the entries which have metadata
+
+    Methods:
+        - *dates*
+        - *text*
+        - *entry_metadata*
+        - *between*
+
+    '''
+    def __init__(self, entries):
+        self.days = array('i')
+        self.words = array('i')
+        self.mins = array('i')
+        self.offsets = array('l', [0])
+        self.metadata = {}
+        texts = []
+        for i, e in enumerate(entries):
+            self.days.append(e['date'].toordinal())
+            self.words.append(e['words'])
+            self.mins.append(e['mins'])
+            if e['metadata']:
+                self.metadata[i] = e['metadata']
+            texts.append(e['text'])
+            self.offsets.append(self.offsets[-1] + len(e['text']))
+        self.buffer = ''.join(texts)
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('entry_table index out of range')
+        return entry_row(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield entry_row(self, i)
+
+    def dates(self):
+        '''Return a list of the datetime of each entry.'''
+        return [datetime.datetime.fromordinal(day) for day in self.days]
+
+    def text(self, index):
+        '''Return the text of entry number *index*.'''
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def entry_metadata(self, index):
+        '''Return the metadata dictionary of entry number *index*.'''
+        return self.metadata.get(index, {})
+
+    def between(self, start, end):
+        '''Return the entries from datetime *start* to *end* inclusive (the
+        entries must be in date order).'''
+        i = bisect.bisect_left(self.days, start.toordinal())
+        j = bisect.bisect_right(self.days, end.toordinal())
+        return self[i:j]
+
+
+class corpus_file(entry_table):
+    '''Entries read lazily from a corpus file written by write_corpus.
+
+    Only the index (the date, position, length, word count and minutes of
+    each entry) is read into memory. The corpus file itself is
+    memory-mapped, so reading an entry's text, or calculating stats for the
+    entries in a date range, only touches the part of the file needed. It
+    can be used anywhere an entry_table can.
+
+    The text of each entry is a UTF-8 byte string, like the entries from
+    read_local_750words (see write_corpus).
+
+    Args:
+        - *fn*: filename of the corpus file; the index is in *fn* + '.idx'
+
+    '''
+    def __init__(self, fn):
+        self.fn = fn
+        self.days = array('i')
+        self.words = array('i')
+        self.mins = array('i')
+        self.positions = []
+        self.lengths = []
+        with open(fn + '.idx', mode='rb') as f:
+            index = f.read()
+        if index[:len(CORPUS_MAGIC)] != CORPUS_MAGIC:
+            raise ValueError('%s is not a corpus index file' % (fn + '.idx'))
+        size = struct.calcsize(CORPUS_RECORD)
+        for pos in range(len(CORPUS_MAGIC) + CORPUS_SOURCE_SIZE, len(index), size):
+            day, position, length, words, mins = struct.unpack_from(CORPUS_RECORD, index, pos)
+            self.days.append(day)
+            self.positions.append(position)
+            self.lengths.append(length)
+            self.words.append(words)
+            self.mins.append(mins)
+        with open(fn, mode='rb') as f:
+            if self.positions:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mm = ''
+
+    def text(self, index):
+        '''Return the text of entry number *index*, as a UTF-8 byte string.'''
+        position = self.positions[index]
+        return self.mm[position:position + self.lengths[index]]
+
+    def entry_metadata(self, index):
+        '''Return the metadata dictionary of entry number *index*, parsed
+        from its text.'''
+        metadata = {}
+        for line in self.text(index).splitlines():
+            flag, key, value, number = parse_line_metadata(line)
+            if flag:
+                metadata.setdefault(key, []).append([value, number])
+        return metadata
+
+    def close(self):
+        if self.positions:
+            self.mm.close()
+
+
+def write_corpus(entries, fn, source=None):
+    '''Write entries to a corpus file, which can be read with corpus_file.
+
+    The text of each entry is written to *fn* one after the other, and an
+    index of the date, position, length, word count and minutes of each
+    entry to *fn* + '.idx'. The entries are written one at a time, so with
+    iter_entries() this works for any size of archive::
+
+        >>> write_corpus(iter_entries(), 'corpus.txt')
+        >>> entries = corpus_file('corpus.txt')
+
+    The corpus holds bytes: texts should be UTF-8 byte strings, as
+    read_local_750words and iter_entries return them. Unicode texts are
+    encoded as UTF-8, so they are read back as byte strings.
+
+    Args:
+        - *entries*: list of dictionaries for each entry, or an iterator
+          over them
+        - *fn*: filename of the corpus file
+        - *source*: up to CORPUS_SOURCE_SIZE characters identifying what
+          the entries were read from, returned by corpus_source
+
+    '''
+    source = source or ''
+    if len(source) > CORPUS_SOURCE_SIZE:
+        raise ValueError('The source must be at most %d characters' % CORPUS_SOURCE_SIZE)
+    position = 0
+    with open(fn + '.tmp', mode='wb') as f:
+        with open(fn + '.idx.tmp', mode='wb') as fidx:
+            fidx.write(CORPUS_MAGIC)
+            fidx.write(source.ljust(CORPUS_SOURCE_SIZE, '\0'))
+            for e in entries:
+                text = e['text']
+                if isinstance(text, unicode):
+                    text = text.encode('utf-8')
+                elif not isinstance(text, str):
+                    raise TypeError('Entry texts must be strings, not %s' % type(text).__name__)
+                f.write(text)
+                fidx.write(struct.pack(CORPUS_RECORD, e['date'].toordinal(),
+                                       position, len(text), e['words'], e['mins']))
+                position += len(text)
+    for name in (fn, fn + '.idx'):
+        if os.path.exists(name):
+            os.remove(name)
+        os.rename(name + '.tmp', name)
+
+
+def corpus_source(fn):
+    '''Return the *source* the corpus file *fn* was written with (see
+    write_corpus), or None if there is no corpus file.'''
+    try:
+        with open(fn + '.idx', mode='rb') as f:
+            header = f.read(len(CORPUS_MAGIC) + CORPUS_SOURCE_SIZE)
+    except IOError:
+        return None
+    if header[:len(CORPUS_MAGIC)] != CORPUS_MAGIC or not os.path.exists(fn):
+        return None
+    return header[len(CORPUS_MAGIC):].rstrip('\0')
+
+
+class entry_row(object):
+    '''One entry of an entry_table, which can be used like that entry's
+    dictionary. Nothing is copied out of the table until it is used.'''
+    fields = ('date', 'words', 'mins', 'metadata', 'text')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        table = self.table
+        i = self.index
+        if key == 'date':
+            return datetime.datetime.fromordinal(table.days[i])
+        elif key == 'words':
+            return table.words[i]
+        elif key == 'mins':
+            return table.mins[i]
+        elif key == 'metadata':
+            return table.entry_metadata(i)
+        elif key == 'text':
+            return table.text(i)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.fields)
+
+    def items(self):
+        return [(key, self[key]) for key in self.fields]
+
+
+def find_streaks(dates, successes, groups=None):
+    '''Find which entries follow on from the day before, and the streaks of
+    consecutive days on which you made 750 words.
+
+    Uses numpy if it is available, which is much faster for long histories.
+
+    Args:
+        - *dates*: list of the datetime of each entry, in order
+        - *successes*: list of bools for whether each entry made 750 words
+        - *groups*: optional list of a value for each entry (e.g. the user),
+          when several people's entries are processed at once; an entry
+          only follows on from the previous one if their groups are equal
+
+    Returns: *consecs, streaks* (see stats_750)
+
+    '''
+    try:
+        import numpy as np
+    except ImportError:
+        return find_streaks_loop(dates, successes, groups)
+    n = len(dates)
+    if not n:
+        return [], []
+    ok = np.asarray(successes, dtype=bool)
+    consec = np.zeros(n, dtype=bool)
+    seconds = np.fromiter(((date - dates[0]).total_seconds() for date in dates),
+                          dtype=float, count=n)
+    consec[1:] = np.diff(seconds) == 24 * 60 * 60
+    if groups is not None:
+        groups = np.asarray(groups)
+        consec[1:] &= groups[1:] == groups[:-1]
+    # An entry continues a streak if it and the entry before it both made
+    # 750 words on consecutive days. Streaks start at the successful entries
+    # which don't continue one, and end before the next entry doesn't.
+    continues = np.zeros(n + 1, dtype=bool)
+    continues[1:n] = ok[1:] & ok[:-1] & consec[1:]
+    starts = np.flatnonzero(ok & ~continues[:n])
+    ends = np.flatnonzero(ok & ~continues[1:])
+    streaks = [[int(end - start + 1), dates[start], dates[end]]
+               for start, end in zip(starts, ends)]
+    return consec.astype(int).tolist(), streaks
+
+
+def find_streaks_loop(dates, successes, groups=None):
+    '''Same as find_streaks, without numpy.'''
+    streaks = []
+    consecs = []
+    streak = 0
+    start = None
+    for i, reached_750 in enumerate(successes):
+        consecutive = 0
+        if i > 0:
+            consecutive = 1
+            if dates[i] - dates[i - 1] != datetime.timedelta(hours=24):
+                consecutive = 0
+            if groups is not None and groups[i] != groups[i - 1]:
+                consecutive = 0
+        consecs.append(consecutive)
+        
+        # you can't have a streak if this entry's date does not follow on from the previous date
+        if not consecutive:
+            if streak > 0:
+                streaks.append([streak, start, dates[i - 1]])
+            streak = 0
+        
+        # if you reached 750 words and aren't on a streak, you have started one
+        if reached_750 and streak == 0:
+            start = dates[i]
+        
+        # no streak yet, and you reached 750 words
+        if not streak and reached_750:
+            streak += 1
+            continue
+            
+        # there is a streak, and you reached 750 words, and you didn't skip a day
+        if streak and reached_750 and consecutive:
+            streak += 1
+            continue
+            
+        # there is a streak, and you failed to reach 750 OR you skipped a day
+        if streak and (not reached_750 or not consecutive):
+            streaks.append([streak, start, dates[i - 1]])
+            streak = 0
+            continue
+    
+    # you are on a streak as of the last day
+    if streak > 0:
+        streaks.append([streak, start, dates[-1]])
+    return consecs, streaks
+
+
+class rolling_stats(dict):
+    '''Statistics over the last few days of writing, as of each entry.
+
+    Everything is calculated in one pass over the entries for each window,
+    adding each entry as the window reaches it and removing it once it is
+    too old, using the *words* and *mins* recorded by parse_markdown.
+
+    Args:
+        - *entries*: a list of dictionaries for each entry, in date order, or
+          an iterator over them such as iter_entries()
+        - *windows*: lengths of the windows in days
+
+    Attributes:
+        - *dates*: numpy array of the date of each entry
+        - Dictionaries of window length -> numpy array of values as of each
+          entry, for the window of days ending on that entry's date:
+            - *words*: total number of words written
+            - *mins*: total number of minutes spent writing
+            - *wpm*: words per minute (nan if no minutes were recorded)
+            - *success_rate*: fraction of days on which you made 750 words
+            - *ttr*: type/token ratio, the number of different (lowercase)
+              words divided by the number of words
+
+    Methods:
+        - *plot*
+
+    '''
+    def __init__(self, entries, windows=(7, 30, 90)):
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError('Rolling statistics require numpy')
+        self.__dict__ = self
+        vocab = vocabulary()
+        dates = []
+        nwords = []
+        mins = []
+        tokens = []
+        for e in entries:
+            dates.append(e['date'])
+            nwords.append(e['words'])
+            mins.append(e['mins'])
+            tokens.append(vocab.encode(w.lower() for w in clean_for_stats(e['text']).split()))
+        self.windows = tuple(windows)
+        self.dates = np.array(dates)
+        for key in ('words', 'mins', 'wpm', 'success_rate', 'ttr'):
+            self[key] = {}
+
+        for window in self.windows:
+            span = datetime.timedelta(days=window)
+            counts = [0] * len(vocab)
+            ntypes = 0
+            ntokens = 0
+            total_words = 0
+            total_mins = 0
+            nsuccesses = 0
+            start = 0
+            values = dict((key, []) for key in ('words', 'mins', 'wpm', 'success_rate', 'ttr'))
+            for i in range(len(dates)):
+                for token in tokens[i]:
+                    if not counts[token]:
+                        ntypes += 1
+                    counts[token] += 1
+                ntokens += len(tokens[i])
+                total_words += nwords[i]
+                total_mins += mins[i]
+                nsuccesses += nwords[i] > 750
+                while dates[i] - dates[start] >= span:
+                    for token in tokens[start]:
+                        counts[token] -= 1
+                        if not counts[token]:
+                            ntypes -= 1
+                    ntokens -= len(tokens[start])
+                    total_words -= nwords[start]
+                    total_mins -= mins[start]
+                    nsuccesses -= nwords[start] > 750
+                    start += 1
+                ndays = min(window, (dates[i] - dates[0]).days + 1)
+                values['words'].append(total_words)
+                values['mins'].append(total_mins)
+                values['wpm'].append(total_words / total_mins if total_mins else np.nan)
+                values['success_rate'].append(nsuccesses / ndays)
+                values['ttr'].append(ntypes / ntokens if ntokens else np.nan)
+            for key, series in values.items():
+                self[key][window] = np.array(series, dtype=float)
+
+    def plot(self, key='words', datefmt='%b\'%y', **kwargs):
+        '''Plot the rolling values of *key* (e.g. 'wpm') for each window.'''
+        try:
+            import matplotlib.pyplot as plt
+            from matplotlib.dates import DateFormatter
+        except ImportError:
+            raise ImportError('Plotting requires matplotlib')
+        kws = dict(ls='-', marker='')
+        kws.update(kwargs)
+        ax = plt.figure(figsize=(13, 4)).add_subplot(111)
+        for window in self.windows:
+            ax.plot_date(self.dates, self[key][window], label='%d days' % window, **kws)
+        ax.xaxis.set_major_formatter(DateFormatter(datefmt))
+        ax.set_ylabel(key)
+        leg = ax.legend(loc='best', )
+        leg.get_frame().set_alpha(0.5)
+
+
 class stats(dict):
     '''Calculate text statistics. Subclass of dict.
 
+    Each statistic is calculated the first time it is used, along with any
+    other statistics it depends on, and then kept. ``_attrs`` lists all the
+    statistics available, whether or not they have been calculated yet.
+
     Args:
         - *text*: string
         - *clean_func*: function to pass *text* through first. Set to None
           to use *text* directly.
 
+    Stats for different texts can be added together (see merge_stats), e.g.
+    ``stats(text1) + stats(text2)``.
+
+    The *bigrams* and *trigrams* (see ngramcounts) are only calculated when
+    they are used, not by compute().
+
     Methods:
         - *ratio*
+        - *ngrams*
+        - *compute*
 
     '''
     def __init__(self, text, clean_func='auto', use_moby=True, 
@@ -336,87 +1069,179 @@ class stats(dict):
         if metadata is None:
             metadata = {}
         self.metadata = metadata
-        if wordfunc is None:
-            wordfunc = lambda x: x
+        self._options = {'text': text, 'clean_func': clean_func,
+                         'use_moby': use_moby, 'stop_at': stop_at,
+                         'stopfn': stopfn, 'stops': stops,
+                         'wordfunc': wordfunc, 'lexicons': list(lexicons)}
+
+        # How each statistic is calculated: name -> (method, the statistics
+        # that method uses). Some methods calculate several statistics.
+        token_attrs = ['lwords', 'word_lengths', 'freqdict']
+        token_attrs += [label for label, words in lexicons]
+        calcs = {'text': ('calc_text', ()),
+                 'words': ('calc_words', ('text', )),
+                 'success': ('calc_success', ('words', )),
+                 'wordfreqpairs': ('calc_wordfreqpairs', ('freqdict', )),
+                 'freqdict2': ('calc_freqdict2', ('freqdict', )),
+                 'wordfreqpairs2': ('calc_wordfreqpairs2', ('freqdict2', )),
+                 'bigrams': ('calc_ngrams', ('text', )),
+                 'trigrams': ('calc_ngrams', ('text', ))}
+        for name in token_attrs:
+            calcs[name] = ('calc_tokens', ('text', ))
+        if use_moby:
+            # Each only loads the Moby table it needs.
+            calcs['syllable_lengths'] = ('calc_syllable_lengths', ('lwords', ))
+            calcs['pos'] = ('calc_pos', ('lwords', ))
+
         self._attrs = ['text', 'words', 'word_lengths', 'success', 'freqdict',
-                       'wordfreqpairs', 'swearing']
+                       'wordfreqpairs'] + [label for label, words in lexicons]
+        if use_moby:
+            self._attrs += ['syllable_lengths', 'pos']
+        self._attrs += ['freqdict2', 'wordfreqpairs2']
+        for label, word, words in ratios:
+            try:
+                assert re.match('[A-Za-z_]', label[0]) is not None
+            except AssertionError, IndexError:
+                print 'Skipping the invalid label "%s"' % label
+                continue
+            calcs[label + '_ratio'] = ('calc_ratios', ('freqdict', ))
+            self._attrs.append(label + '_ratio')
+        self._calcs = calcs
+
+    def __missing__(self, key):
+        calcs = dict.get(self, '_calcs', {})
+        if not key in calcs:
+            raise KeyError(key)
+        method, dependencies = calcs[key]
+        for dependency in dependencies:
+            self[dependency]
+        getattr(self, method)()
+        return dict.__getitem__(self, key)
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def compute(self, keys=None):
+        '''Calculate all the statistics (or only those in *keys*) now,
+        rather than when they are first used. Returns self.'''
+        if keys is None:
+            keys = self._attrs
+        for key in keys:
+            self[key]
+        return self
+
+    def calc_text(self):
+        clean_func = self._options['clean_func']
         if clean_func is None:
-            clean_func = lambda x: x
-        elif clean_func == 'auto':
-            clean_func = clean_for_stats
-        text = clean_func(text)
+            self.text = self._options['text']
+        else:
+            if clean_func == 'auto':
+                clean_func = clean_for_stats
+            self.text = clean_func(self._options['text'])
+
+    def calc_words(self):
+        self.words = count_words(self.text)
 
-        self.lwords = [w.lower() for w in text.split()]
-        self.text = text
-        self.words = count_words(text)
-        self.word_lengths = [len(w) for w in self.lwords]
+    def calc_success(self):
         self.success = True if self.words >= 750 else False
-        self.freqdict = freqdict(text, wordfunc=wordfunc)
+
+    def calc_tokens(self):
+        opts = self._options
+        self.update(analyse_tokens(self.text, wordfunc=opts['wordfunc'],
+                                   lexicons=opts['lexicons']))
+
+    def calc_syllable_lengths(self):
+        self.syllable_lengths = syllable_lengths(self.lwords)
+
+    def calc_pos(self):
+        self.pos = pos_counts(self.lwords)
+
+    def calc_wordfreqpairs(self):
         self.wordfreqpairs = wordfreqpairs(self.freqdict)
-        self.swearing = 0
-        for word in self.lwords:
-            for swearword in swearwords:
-                if swearword in word:
-                    self.swearing += 1
-        if use_moby:
-            import moby
-            self._attrs += ['syllable_lengths', 'pos',
-                            'freqdict2', 'wordfreqpairs2']
-            self.syllable_lengths = [len(moby.syllables[w]) for w in 
-                                     self.lwords if w in moby.syllables]
-            poses = {}
-            for pos in moby.postypes.values():
-                poses[pos] = 0
-                for word in self.lwords:
-                    try:
-                        for wpos in moby.pos[word]:
-                            poses[wpos] += 1
-                    except KeyError:
-                        continue
-            self.pos = poses
-            self.freqdict2 = self.freqdict.copy()
-
-        def open_wordlist(fn):
-            with open(fn, mode='r') as f:
-                words = [line.strip('\n').strip() for line in f.readlines()]
-            return words
 
+    def calc_freqdict2(self):
+        opts = self._options
+        stops = opts['stops']
+        stop_at = opts['stop_at']
+        wordfunc = opts['wordfunc']
+        if wordfunc is None:
+            wordfunc = lambda x: x
         if not stops:
-            if stopfn == 'moby':
+            stops = []
+            if opts['stopfn'] == 'moby':
                 import moby
                 stops = moby.freq
-            elif stopfn:
+            elif opts['stopfn']:
                 try:
-                    stops = open_wordlist(stopfn)
+                    stops = open_wordlist(opts['stopfn'])
                 except:
                     pass
         if stop_at > len(stops):
             stop_at = None
         else:
             stop_at = int(stop_at)
+        self.freqdict2 = self.freqdict.copy()
         for word in stops[:stop_at]:
             word = wordfunc(word)
             if word in self.freqdict2:
                 del self.freqdict2[word]
+
+    def calc_wordfreqpairs2(self):
         self.wordfreqpairs2 = wordfreqpairs(self.freqdict2)
 
+    def calc_ngrams(self):
+        self.bigrams = self.ngrams(2)
+        self.trigrams = self.ngrams(3)
+
+    def ngrams(self, n=2):
+        '''Return an ngramcounts of the n-grams of the words counted in
+        freqdict (i.e. after *clean_func* and *wordfunc*).'''
+        if n == 2 and 'bigrams' in self:
+            return self.bigrams
+        if n == 3 and 'trigrams' in self:
+            return self.trigrams
+        wordfunc = self.get('_options', {}).get('wordfunc')
+        if wordfunc is None:
+            wordfunc = lambda x: x
+        words = [wordfunc(w) for w in self.text.split()]
+        counts = ngramcounts(n)
+        # Merged stats remember how many words each text had, so that
+        # n-grams don't run from one text into the next.
+        start = 0
+        for length in self.get('_segments', [len(words)]):
+            counts.add(words[start:start + length])
+            start += length
+        return counts
+
+    def calc_ratios(self):
         for label, word, words in ratios:
-            try:
-                assert re.match('[A-Za-z_]', label[0]) is not None
-            except AssertionError, IndexError:
-                print 'Skipping the invalid label "%s"' % label
-                continue
-            label += '_ratio'
-            self[label] = self.ratio(word, words)
-            self._attrs.append(label)
+            if label + '_ratio' in self._calcs:
+                self[label + '_ratio'] = self.ratio(word, words)
 
     def ratio(self, word, words):
         '''Return ratio of frequencies: *word* / *words*.'''
-        denominator = sum((self.freqdict[w] for w in words))
+        denominator = sum((self.freqdict.get(w, 0) for w in words))
         if denominator == 0:
             return None
         else:
-            return self.freqdict[word] / denominator
+            return self.freqdict.get(word, 0) / denominator
+
+    def __add__(self, other):
+        return merge_stats([self, other])
+
+    def __radd__(self, other):
+        # So that sum() works, which starts with 0.
+        if other == 0:
+            return merge_stats([self])
+        return merge_stats([other, self])
+
+    def __setstate__(self, state):
+        # The items are restored before this is called when unpickling, so
+        # this only needs to point the attributes back at them.
+        self.__dict__ = self
        
     def __str__(self):
         if len(self.text) < 40:
@@ -426,7 +1251,7 @@ class stats(dict):
         s = '\n'.join(('Words: %d' % self.words,
                        'Text: "%s"...' % hint,
                        'Most common words: ' + ', '.join(
-                           ('%s (%d)' % (word, freq) for word, freq in self.wordfreqpairs[:5]))
+                           ('%s (%d)' % (word, freq) for word, freq in wordfreqpairs(self.freqdict, 5)))
                        + ', ...'
                        ))
         return s
@@ -438,19 +1263,85 @@ class entrystats(list):
     so each item is the statistics for each entry/paras.
 
     Args:
-        - *entries*: list of dictionaries for each entry/paragraph.
+        - *entries*: list of dictionaries for each entry/paragraph, or an
+          iterator over them such as iter_entries().
+        - *workers*: number of processes to calculate the statistics with.
+          By default they are calculated one entry at a time in this process.
+        - other keyword arguments are passed to stats
 
     Methods:
+        - *merge*
+        - *ngrams*
+        - *corpus*
         - *plot_word_lengths*
 
     '''
-    def __init__(self, entries, **kwargs):
-        list.__init__(self, [stats(e['text'], metadata=e, **kwargs) for e in entries])
+    def __init__(self, entries, workers=None, **kwargs):
+        self.kwargs = kwargs
+        if workers is None or workers <= 1:
+            list.__init__(self, [stats(e['text'], metadata=e, **kwargs) for e in entries])
+        else:
+            list.__init__(self, pool_stats(entries, workers, **kwargs))
     
     def __getattr__(self, key):
         if key in self[0]._attrs:
             return [s[key] for s in self]
+
+    def merge(self, key=None):
+        '''Merge the statistics of the entries (see merge_stats).
+
+        Args:
+            - *key*: function of each entry's dictionary which returns the
+              group the entry belongs to, e.g. ``lambda e: e['date'].year``.
+              If None, all the entries are merged together.
+
+        Returns: stats for all entries, or if *key* is given, a dictionary
+        of group -> stats for the entries in that group.
+
+        '''
+        if key is None:
+            return merge_stats(self)
+        groups = {}
+        for s in self:
+            groups.setdefault(key(s.metadata), []).append(s)
+        return dict((group, merge_stats(parts)) for group, parts in groups.items())
+
+    def ngrams(self, n=2, key=None):
+        '''Count the n-grams in the entries, without counting each entry's
+        separately and then merging them.
+
+        Args:
+            - *n*: number of words in each n-gram
+            - *key*: as for merge, e.g. ``lambda e: e['date'].year``
+
+        Returns: ngramcounts for all entries, or if *key* is given, a
+        dictionary of group -> ngramcounts for the entries in that group.
+        Compare two groups with ngramcounts.compare, e.g.
+        ``grams[2013].compare(grams[2012])``.
+
+        '''
+        wordfunc = self.kwargs.get('wordfunc')
+        if wordfunc is None:
+            wordfunc = lambda x: x
+        # The groups share a vocabulary, so comparing them is cheap.
+        vocab = vocabulary()
+        groups = {}
+        for s in self:
+            group = None if key is None else key(s.metadata)
+            if not group in groups:
+                groups[group] = ngramcounts(n, vocab)
+            groups[group].add([wordfunc(w) for w in s.text.split()])
+        if key is None:
+            return groups.get(None, ngramcounts(n, vocab))
+        return groups
     
+    def corpus(self, vocab=None):
+        '''Return a corpus of the words counted in each entry's freqdict
+        (i.e. after *clean_func* and *wordfunc*), for counting the words of
+        many entries at once as integer token ids.'''
+        return corpus([{'date': s.metadata.get('date'), 'text': s.text} for s in self],
+                      clean_func=None, wordfunc=self.kwargs.get('wordfunc'), vocab=vocab)
+
     def plot_word_lengths(self):
         try:
             import numpy as np
@@ -477,6 +1368,576 @@ class entrystats(list):
 
 
 
+def merge_stats(parts):
+    '''Combine the stats of several texts into the stats of all of them
+    together, without tokenising the texts again.
+
+    Counts, frequency dictionaries, parts of speech, lexicon counts and lists
+    of word and syllable lengths are combined exactly; *success*, ratios and
+    the (word, freq) lists are then calculated from the combined counts. The
+    text is the texts of *parts* joined by newlines, and the metadata is
+    empty.
+
+    Args:
+        - *parts*: list of stats, all calculated with the same options
+
+    Returns: stats
+
+    '''
+    parts = list(parts)
+    if not parts:
+        raise ValueError('There are no stats to merge')
+    first = parts[0]
+    for part in parts[1:]:
+        if part._attrs != first._attrs:
+            raise ValueError('Only stats calculated with the same options '
+                             '(e.g. use_moby) can be merged')
+    keys = ['text', 'words', 'freqdict2']
+    keys += [name for name, (method, dependencies) in first._calcs.items()
+             if method in ('calc_tokens', 'calc_syllable_lengths', 'calc_pos')]
+    # N-grams are only merged if every part has them; otherwise they are
+    # calculated from the merged text when needed, one part at a time.
+    keys += [name for name, (method, dependencies) in first._calcs.items()
+             if method == 'calc_ngrams' and all(name in part for part in parts)]
+
+    merged = stats.__new__(stats)
+    merged.__dict__ = merged
+    merged.metadata = {}
+    merged._attrs = list(first._attrs)
+    merged._calcs = dict(first._calcs)
+    if '_options' in first:
+        merged._options = dict(first._options, text=None)
+    merged._segments = [length for part in parts
+                        for length in part.get('_segments', [part['words']])]
+    for key in keys:
+        values = [part[key] for part in parts]
+        if isinstance(values[0], basestring):
+            merged[key] = '\n'.join(values)
+        elif isinstance(values[0], list):
+            merged[key] = [v for value in values for v in value]
+        elif isinstance(values[0], ngramcounts):
+            total = ngramcounts(values[0].n)
+            for value in values:
+                total += value
+            merged[key] = total
+        elif isinstance(values[0], dict):
+            total = defaultdict(int)
+            for value in values:
+                for k, v in value.iteritems():
+                    total[k] += v
+            merged[key] = total if isinstance(values[0], defaultdict) else dict(total)
+        else:
+            merged[key] = sum(values)
+    return merged
+
+
+def pool_stats(entries, workers, **kwargs):
+    '''Calculate stats for each entry using a pool of *workers* processes.
+
+    The Moby data is loaded before the pool is started, so on systems with
+    fork() the workers share it rather than each loading it again. Keyword
+    arguments are handed to the workers when they start, so they don't need
+    to be picklable where fork() is available.
+
+    Returns: list of stats, one for each entry, in the same order.
+
+    '''
+    import multiprocessing
+    entries = list(entries)
+    if kwargs.get('use_moby', True):
+        import moby
+        moby.preload(('syllables', 'pos'))
+    if kwargs.get('stopfn') == 'moby' and not kwargs.get('stops'):
+        import moby
+        moby.preload(('freq', ))
+    pool = multiprocessing.Pool(workers, initializer=init_stats_worker,
+                                initargs=(kwargs, ))
+    try:
+        results = pool.map(stats_worker, [e['text'] for e in entries])
+    finally:
+        pool.close()
+        pool.join()
+    for s, e in zip(results, entries):
+        s.metadata = e
+    return results
+
+
+stats_worker_kwargs = {}
+
+
+def init_stats_worker(kwargs):
+    '''Set the keyword arguments for stats_worker in a pool process.'''
+    stats_worker_kwargs.clear()
+    stats_worker_kwargs.update(kwargs)
+
+
+def stats_worker(text):
+    '''Return stats for *text* in a pool process (see pool_stats).'''
+    s = stats(text, **stats_worker_kwargs).compute()
+    # Everything is calculated, so the options (which may include functions
+    # that can't be pickled) aren't needed any more.
+    del s['_options']
+    return s
+
+
+class vocabulary(object):
+    '''Mapping between tokens and integer ids, shared by a whole corpus so
+    each distinct token is only stored once.
+
+    Attributes:
+        - *ids*: dictionary of token -> id
+        - *tokens*: list of tokens, indexed by id
+
+    Methods:
+        - *intern*
+        - *encode*
+        - *decode*
+        - *mask*
+
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.ids
+
+    def intern(self, token):
+        '''Return the id for *token*, adding it to the vocabulary if needed.'''
+        try:
+            return self.ids[token]
+        except KeyError:
+            self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            return self.ids[token]
+
+    def encode(self, words):
+        '''Return an array('i') of the ids of *words*.'''
+        return array('i', [self.intern(w) for w in words])
+
+    def decode(self, ids):
+        '''Return the list of tokens for *ids*.'''
+        return [self.tokens[i] for i in ids]
+
+    def mask(self, words):
+        '''Return a list of bools, one per id, True for the ids of *words*
+        which are in the vocabulary.'''
+        mask = [False] * len(self)
+        for word in words:
+            if word in self.ids:
+                mask[self.ids[word]] = True
+        return mask
+
+
+def bincount(ids, n, mask=None):
+    '''Return the number of times each id from 0 to *n* - 1 occurs in *ids*
+    (a sequence of ints, such as an array('i') or a numpy int32 array, or a
+    list of them). Uses numpy if it is available, counting all the sequences
+    together in one go, and returns a numpy array; otherwise a list.
+
+    Args:
+        - *mask*: list of bools, one per id; the counts of the ids which
+          are True are set to zero (see vocabulary.mask)
+
+    '''
+    if len(ids) and isinstance(ids[0], numbers.Integral):
+        ids = [ids]
+    try:
+        import numpy as np
+    except ImportError:
+        counts = [0] * n
+        for stream in ids:
+            for i in stream:
+                counts[i] += 1
+        if mask is not None:
+            for i, masked in enumerate(mask):
+                if masked:
+                    counts[i] = 0
+        return counts
+    streams = [np.frombuffer(stream, dtype=np.intc) if isinstance(stream, array)
+               else np.asarray(stream, dtype=np.intc) for stream in ids if len(stream)]
+    if streams:
+        counts = np.bincount(np.concatenate(streams), minlength=n)
+    else:
+        counts = np.zeros(n, dtype=np.intp)
+    if mask is not None:
+        counts[np.asarray(mask, dtype=bool)] = 0
+    return counts
+
+
+class corpus(list):
+    '''Entries stored as compact streams of integer token ids. Subclasses
+    list, so each item is an array('i') of the tokens of each entry.
+
+    The tokens are the same as those counted by freqdict (i.e. *text* after
+    *clean_func* is split on whitespace and each word passed through
+    *wordfunc*), so the frequencies and ratios here match those of stats.
+
+    Args:
+        - *entries*: list of dictionaries for each entry/paragraph, or an
+          iterator over them such as iter_entries()
+        - *clean_func*: as for stats
+        - *wordfunc*: as for stats
+        - *vocab*: vocabulary to add tokens to; a new one by default
+
+    Attributes:
+        - *vocab*: the vocabulary
+        - *dates*: the date of each entry
+
+    Methods:
+        - *counts*
+        - *freqdict*
+        - *wordfreqpairs*
+        - *ratio*
+        - *ngrams*
+
+    '''
+    def __init__(self, entries, clean_func='auto', wordfunc=None, vocab=None):
+        if vocab is None:
+            vocab = vocabulary()
+        if clean_func is None:
+            clean_func = lambda x: x
+        elif clean_func == 'auto':
+            clean_func = clean_for_stats
+        if wordfunc is None:
+            wordfunc = lambda x: x
+        self.vocab = vocab
+        self.dates = []
+        for e in entries:
+            self.dates.append(e.get('date'))
+            self.append(vocab.encode(wordfunc(w) for w in clean_func(e['text']).split()))
+
+    def counts(self, index=None, stops=None):
+        '''Return the number of times each token id occurs (see bincount).
+
+        Args:
+            - *index*: entry number, or a slice of entry numbers; by default
+              all entries are counted
+            - *stops*: list of words to leave out (their counts are zero)
+
+        '''
+        if index is None:
+            streams = list(self)
+        elif isinstance(index, slice):
+            streams = self[index]
+        else:
+            streams = [self[index]]
+        mask = self.vocab.mask(stops) if stops else None
+        return bincount(streams, len(self.vocab), mask)
+
+    def freqdict(self, index=None, stops=None):
+        '''Return a dictionary of word frequencies, like freqdict (see
+        counts for the arguments).'''
+        tokens = self.vocab.tokens
+        counts = self.counts(index, stops)
+        if isinstance(counts, list):
+            return dict((tokens[i], n) for i, n in enumerate(counts) if n)
+        # Only the tokens which occur are looked at.
+        ids = counts.nonzero()[0]
+        return dict(zip([tokens[i] for i in ids], counts[ids].tolist()))
+
+    def wordfreqpairs(self, index=None, stops=None):
+        '''Return an ordered list of (word, freq) tuples, like wordfreqpairs.'''
+        return wordfreqpairs(self.freqdict(index, stops))
+
+    def ratio(self, word, words, index=None):
+        '''Return ratio of frequencies: *word* / *words*, as for stats.ratio.'''
+        counts = self.counts(index)
+        ids = self.vocab.ids
+        denominator = sum(int(counts[ids[w]]) for w in words if w in ids)
+        if denominator == 0:
+            return None
+        return int(counts[ids[word]]) / denominator if word in ids else 0
+
+    def ngrams(self, n=2, index=None):
+        '''Return an ngramcounts of the n-grams in the entries (see counts
+        for *index*), sharing this corpus's vocabulary.'''
+        if index is None:
+            streams = list(self)
+        elif isinstance(index, slice):
+            streams = self[index]
+        else:
+            streams = [self[index]]
+        counts = ngramcounts(n, self.vocab)
+        for stream in streams:
+            counts.add_ids(stream)
+        return counts
+
+
+
+class ngramcounts(object):
+    '''Frequencies of n-grams (runs of *n* consecutive words).
+
+    Each n-gram is stored as a single integer, made by packing the ids of
+    its words (from a vocabulary) into NGRAM_BITS bits each, rather than as
+    a tuple of words. Only the n-grams which are asked for (e.g. the most
+    frequent ones) are turned back into tuples of words.
+
+    N-grams don't run across the end of one list of words (e.g. entry) and
+    the start of the next.
+
+    Args:
+        - *n*: number of words in each n-gram
+        - *vocab*: vocabulary to add words to; a new one by default. Counts
+          which share a vocabulary can be added together and compared
+          without translating their ids.
+
+    Attributes:
+        - *counts*: dictionary of packed n-gram -> frequency
+        - *total*: number of n-grams counted
+
+    Methods:
+        - *add*
+        - *add_ids*
+        - *freq*
+        - *freqdict*
+        - *wordfreqpairs*
+        - *compare*
+
+    '''
+    def __init__(self, n=2, vocab=None):
+        if vocab is None:
+            vocab = vocabulary()
+        self.n = n
+        self.vocab = vocab
+        self.counts = defaultdict(int)
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, words):
+        '''Count the n-grams in the list of *words*.'''
+        self.add_ids(self.vocab.encode(words))
+
+    def add_ids(self, ids):
+        '''Count the n-grams in a sequence of token *ids* from the vocabulary.'''
+        if len(self.vocab) > 1 << NGRAM_BITS:
+            raise ValueError('Too many distinct words to pack into n-grams')
+        n = self.n
+        mask = (1 << NGRAM_BITS * n) - 1
+        counts = self.counts
+        key = 0
+        for i, token in enumerate(ids):
+            key = ((key << NGRAM_BITS) | token) & mask
+            if i >= n - 1:
+                counts[key] += 1
+        self.total += max(len(ids) - n + 1, 0)
+
+    def pack(self, words):
+        '''Return the packed key for a sequence of *words*, or None if any
+        of them have never been seen.'''
+        key = 0
+        for word in words:
+            if not word in self.vocab:
+                return None
+            key = (key << NGRAM_BITS) | self.vocab.ids[word]
+        return key
+
+    def unpack(self, key):
+        '''Return the tuple of words for the packed *key*.'''
+        idmask = (1 << NGRAM_BITS) - 1
+        ids = []
+        for i in range(self.n):
+            ids.append(key & idmask)
+            key >>= NGRAM_BITS
+        return tuple(self.vocab.decode(reversed(ids)))
+
+    def freq(self, words):
+        '''Return the frequency of the n-gram *words* (a tuple of words, or
+        a string of them separated by spaces).'''
+        if isinstance(words, basestring):
+            words = words.split()
+        return self.counts.get(self.pack(words), 0)
+
+    def freqdict(self):
+        '''Return a dictionary of (tuple of words) -> frequency for all
+        the n-grams.'''
+        return dict((self.unpack(key), count) for key, count in self.counts.iteritems())
+
+    def wordfreqpairs(self, n=None):
+        '''Return an ordered list of (tuple of words, freq) tuples for the
+        *n* most frequent n-grams (or all of them).'''
+        return [(self.unpack(key), count) for key, count in
+                wordfreqpairs(self.counts, n)]
+
+    def compare(self, other, n=20, smoothing=0.5):
+        '''Find the n-grams which are most over-represented here compared to
+        *other* (e.g. one year's writing compared to the year before).
+
+        N-grams are scored by the log of the ratio of their relative
+        frequencies here and in *other*, with *smoothing* added to each
+        count so that n-grams missing from *other* don't score infinitely.
+
+        Returns: list of (tuple of words, score, freq here, freq in other)
+        tuples for the *n* highest scoring n-grams.
+
+        '''
+        if other.n != self.n:
+            raise ValueError('Can only compare counts of n-grams of the same length')
+        # Looking other's words up doesn't add them to this vocabulary; the
+        # n-grams with words which aren't in it can't occur here.
+        other_counts = self._translate(other, add=False)
+        only_other = len(other.counts) - len(other_counts)
+        distinct = len(set(self.counts) | set(other_counts)) + only_other
+        here_total = self.total + smoothing * distinct
+        other_total = other.total + smoothing * distinct
+        log = math.log
+        def score(item):
+            key, count = item
+            return (log((count + smoothing) / here_total)
+                    - log((other_counts.get(key, 0) + smoothing) / other_total))
+        top = heapq.nlargest(n, self.counts.iteritems(), key=score)
+        return [(self.unpack(key), score((key, count)), count,
+                 other_counts.get(key, 0)) for key, count in top]
+
+    def _translate(self, other, add=True):
+        '''Return the counts of *other* keyed by this vocabulary's ids.
+
+        If *add* is False, words which aren't in this vocabulary aren't
+        added to it, and the n-grams containing them are left out.
+
+        '''
+        if other.vocab is self.vocab:
+            return other.counts
+        if add:
+            ids = [self.vocab.intern(token) for token in other.vocab.tokens]
+        else:
+            ids = [self.vocab.ids.get(token) for token in other.vocab.tokens]
+        idmask = (1 << NGRAM_BITS) - 1
+        counts = defaultdict(int)
+        for key, count in other.counts.iteritems():
+            new = 0
+            for shift in range(NGRAM_BITS * (self.n - 1), -1, -NGRAM_BITS):
+                i = ids[(key >> shift) & idmask]
+                if i is None:
+                    break
+                new = (new << NGRAM_BITS) | i
+            else:
+                counts[new] += count
+        return counts
+
+    def __iadd__(self, other):
+        if other.n != self.n:
+            raise ValueError('Can only add counts of n-grams of the same length')
+        counts = self.counts
+        for key, count in self._translate(other).iteritems():
+            counts[key] += count
+        self.total += other.total
+        return self
+
+    def __add__(self, other):
+        # A new vocabulary unless they already share one, so that neither
+        # of the counts being added has words added to its vocabulary.
+        total = ngramcounts(self.n, self.vocab if other.vocab is self.vocab else None)
+        total += self
+        total += other
+        return total
+
+    def __radd__(self, other):
+        # So that sum() works, which starts with 0.
+        if other == 0:
+            return self + ngramcounts(self.n, self.vocab)
+        return other + self
+
+    def __str__(self):
+        return '\n'.join('%s (%d)' % (' '.join(words), count)
+                         for words, count in self.wordfreqpairs(10))
+
+
+class archive(object):
+    '''Your 750 words months, kept up to date incrementally.
+
+    Old months can't change on 750words.com, so only the export files which
+    are new or have changed since the last update() are parsed, and only
+    their entries have their statistics recalculated. A month counts as
+    changed when the MD5 hash of its export file differs from the one this
+    archive last saw. The manifest of parsed months is kept on disk (see
+    update_manifest), so this also holds between sessions.
+
+    Args:
+        - *path*: folder containing the export files
+        - *cache*: as for read_local_750words
+
+    Attributes:
+        - *months*: dictionary of 'YYYY-MM' -> manifest dictionary for that
+          month's export file
+        - *changed*: list of 'YYYY-MM' months which were added, changed or
+          removed by the last update()
+
+    Methods:
+        - *update*
+        - *entries*
+        - *clean_md*
+        - *stats_750*
+        - *entrystats*
+
+    '''
+    def __init__(self, path=DEFAULT_PATH, cache=True):
+        if cache is True:
+            cache = default_cache_fn(path)
+        self.path = path
+        self.cache = cache
+        self.months = {}
+        self.changed = []
+        self._entrystats = {}
+        self.update()
+
+    def update(self):
+        '''Re-read any changed export files and return the list of months
+        which changed.'''
+        fns = find_export_files(self.path)
+        items, changed = update_manifest(fns, cache_fn=self.cache)
+        months = dict((get_yeardate(fn), item) for fn, item in zip(fns, items))
+        # Compare with this archive's own months rather than using *changed*,
+        # since something else may have brought the manifest up to date.
+        self.changed = sorted(
+                [ym for ym, item in months.items() if not ym in self.months or
+                 self.months[ym]['md5'] != item['md5']] +
+                [ym for ym in self.months if not ym in months])
+        for ym in self.changed:
+            if ym in self._entrystats:
+                del self._entrystats[ym]
+        self.months = months
+        return self.changed
+
+    def entries(self):
+        '''Return a list of all entries.'''
+        entries = []
+        for ym in sorted(self.months.keys()):
+            entries += self.months[ym]['entries']
+        return entries
+
+    def clean_md(self):
+        '''Return the cleaned Markdown of all entries.'''
+        return '\n'.join(self.months[ym]['clean_md'] for ym in sorted(self.months.keys()))
+
+    def stats_750(self, **kwargs):
+        '''Return stats_750 for all entries, using the word counts stored
+        in the manifest.'''
+        nwords = []
+        for ym in sorted(self.months.keys()):
+            nwords += self.months[ym]['nwords']
+        return stats_750(self.entries(), nwords=nwords, **kwargs)
+
+    def entrystats(self, **kwargs):
+        '''Return entrystats for all entries, re-using the results for
+        each month unless that month has changed or *kwargs* are different
+        from last time.'''
+        estats = entrystats([])
+        for ym in sorted(self.months.keys()):
+            prev_kwargs, month_estats = self._entrystats.get(ym, (None, None))
+            if month_estats is None or prev_kwargs != kwargs:
+                month_estats = entrystats(self.months[ym]['entries'], **kwargs)
+                self._entrystats[ym] = (kwargs, month_estats)
+            estats += month_estats
+        return estats
+
+
+
 months = dict(zip(['NOTHING', 'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul',
                    'aug', 'sep', 'oct', 'nov', 'dec'], range(13)))
 
@@ -546,8 +2007,58 @@ def parse_markdown(raw_md, header_prefix='## '):
     return clean_md, entries
 
 
+def iter_markdown_entries(lines):
+    '''Parse entries from the lines of 750 words export files.
+
+    This works like parse_markdown, but *lines* can be any iterable of lines
+    (without line endings) and the entry dictionaries are yielded one at a
+    time. No cleaned Markdown is produced.
+
+    An entry whose header is the last thing in *lines* is yielded with no
+    text. If *lines* ends part way through an entry header, the entries
+    before it are yielded and then ValueError is raised.
+
+    '''
+    lines = iter(lines)
+    entry = None
+    for line in lines:
+        if line.startswith('------ ENTRY ------'):
+            header = [next(lines, None) for i in range(3)]
+            if None in header:
+                if entry is not None:
+                    entry['text'] = '\n'.join(entry.pop('entry_lines'))
+                    yield entry
+                raise ValueError('The lines end part way through an entry header')
+            date, words, mins = [strip_pair(line) for line in header]
+            if int(words):
+                if entry is not None:
+                    entry['text'] = '\n'.join(entry.pop('entry_lines'))
+                    yield entry
+                entry = {'date': str2dt(date),
+                         'words': int(words),
+                         'mins': int(mins),
+                         'metadata': {},
+                         'entry_lines': []}
+            line = next(lines, None)
+            if line is None:
+                break
+        if entry is not None:
+            flag, key, value, number = parse_line_metadata(line)
+            if flag:
+                emdict = entry['metadata']
+                if key in emdict:
+                    emdict[key].append([value, number])
+                else:
+                    emdict[key] = [[value, number]]
+            entry['entry_lines'].append(line)
+    if entry is not None:
+        entry['text'] = '\n'.join(entry.pop('entry_lines'))
+        yield entry
+
+
 def paragraphs(entries):
-    '''Convert entries to paragraphs.'''
+    '''Convert entries (a list, or an iterator such as iter_entries()) to
+    paragraphs.'''
     allparas = []
     for entry in entries:
         paras = entry['text'].split('\n\n')
@@ -599,8 +2110,8 @@ def metalist(key, entries):
     for entry in entries:
         if key in entry['metadata']:
             for mentry in entry['metadata'][key]:
-                values.append(entry['metadata'][key][0])
-                numbers.append(entry['metadata'][key][1])
+                values.append(mentry[0])
+                numbers.append(mentry[1])
         else:
             values.append(None)
             numbers.append(None)
@@ -616,51 +2127,158 @@ def get_yeardate(fn):
 
 def find_export_files(path):
     '''Find export files, discard smaller duplicates, sort by date,
-    and return list of filenames.'''
-    now = datetime.datetime.today()
-    fns = sorted(glob.glob(os.path.join(path, '750 Words-export-*')), key=get_yeardate)
-    if not len(fns):
-        return []
-    ym0 = get_yeardate(fns[0])
-    year, month = map(int, get_yeardate(fns[0]).split('-'))
-    fns1 = []
-    while year <= now.year:
-        if month > 12:
-            month = 1
-        if year == now.year:
-            condition = month <= now.month
+    and return list of filenames (see export_catalog).'''
+    return get_catalog(path).filenames()
+
+
+class export_catalog(object):
+    '''The export files in a folder, found in a single pass over its
+    directory listing, grouped by month.
+
+    Files are recognised by name ("750 Words-export-jan-2013.txt", or copies
+    such as "750 Words-export-jan-2013 (1).txt"). Months after the current
+    one are ignored. Where there are several files for a month, the largest
+    is chosen (or the newest, if *prefer* is 'newest'), and any which are
+    the same size as it are hashed to find exact duplicates; of those, the
+    one with the shortest name is used.
+
+    Args:
+        - *path*: folder containing the export files
+        - *prefer*: 'largest' or 'newest'
+
+    Attributes:
+        - *mtime*: modification time of the folder when it was scanned,
+          or None if it couldn't be read
+        - *months*: dictionary of 'YYYY-MM' -> list of (filename, size,
+          mtime) for each file for that month
+        - *chosen*: dictionary of 'YYYY-MM' -> the chosen filename
+        - *duplicates*: dictionary of filename -> the chosen filename with
+          exactly the same contents
+
+    Methods:
+        - *filenames*
+
+    '''
+    def __init__(self, path, prefer='largest'):
+        self.path = path
+        self.prefer = prefer
+        try:
+            self.mtime = os.stat(path).st_mtime
+            files = scan_folder(path, '750 Words-export-')
+        except OSError:
+            # A missing folder just has no export files.
+            self.mtime = None
+            files = []
+        now = datetime.datetime.today()
+        latest = '%d-%02d' % (now.year, now.month)
+        self.months = {}
+        for name, size, mtime in files:
+            month = months.get(name[17:20])
+            year = name[21:25]
+            if month is None or not year.isdigit():
+                continue
+            yeardate = '%s-%02d' % (year, month)
+            if yeardate <= latest:
+                fn = os.path.join(path, name)
+                self.months.setdefault(yeardate, []).append((fn, size, mtime))
+        if prefer == 'newest':
+            key = lambda f: (f[2], f[1], f[0])
         else:
-            condition = True
-        while condition and month <= 12:
-            search = '750 Words-export-%s-%02.0f*' % (months_inv[month], year)
-            mfns = glob.glob(os.path.join(path, search))
-            max_size = -1
-            max_fn = None
-            for mfn in mfns:
-                if os.path.getsize(mfn) > max_size:
-                    max_size = os.path.getsize(mfn)
-                    max_fn = mfn
-            if max_fn:
-                fns1.append(max_fn)
-            month += 1
-        year += 1
-    return sorted(fns1, key=get_yeardate)
-
-
-def get_all_urls(session):
+            key = lambda f: (f[1], f[2], f[0])
+        self.chosen = {}
+        self.duplicates = {}
+        for yeardate, files in self.months.items():
+            best = max(files, key=key)
+            identical = [best[0]]
+            same_size = [f for f in files if f[1] == best[1] and f is not best]
+            if same_size:
+                digest = file_md5(best[0])
+                identical += [f[0] for f in same_size if file_md5(f[0]) == digest]
+            # Of identical copies, keep the original name rather than "... (1)"
+            chosen = min(identical, key=lambda fn: (len(fn), fn))
+            self.chosen[yeardate] = chosen
+            for fn in identical:
+                if fn != chosen:
+                    self.duplicates[fn] = chosen
+
+    def filenames(self):
+        '''Return the chosen filename for each month, in date order.'''
+        return [self.chosen[yeardate] for yeardate in sorted(self.chosen)]
+
+
+catalogs = {}
+
+
+def get_catalog(path, prefer='largest'):
+    '''Return the export_catalog of *path*, re-using the last one made if
+    the folder hasn't changed since (adding, removing or renaming files
+    changes its modification time), and the current month is the same.'''
+    key = (os.path.abspath(path), prefer)
+    catalog = catalogs.get(key)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    now = datetime.datetime.today()
+    if (catalog is None or catalog.mtime != mtime or
+            catalog.month != (now.year, now.month)):
+        catalog = export_catalog(path, prefer)
+        catalog.month = (now.year, now.month)
+        catalogs[key] = catalog
+    return catalog
+
+
+def scan_folder(path, prefix=''):
+    '''Return a list of (name, size, mtime) for the files in *path* whose
+    names start with *prefix*, listing the folder only once. Uses scandir
+    if it is available.'''
+    try:
+        from os import scandir
+    except ImportError:
+        try:
+            from scandir import scandir
+        except ImportError:
+            scandir = None
+    files = []
+    if scandir is None:
+        for name in os.listdir(path):
+            if name.startswith(prefix):
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                files.append((name, st.st_size, st.st_mtime))
+    else:
+        for entry in scandir(path):
+            if entry.name.startswith(prefix) and entry.is_file():
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime))
+    return files
+
+
+def file_md5(fn):
+    '''Return the MD5 hash of the contents of *fn*.'''
+    md5 = hashlib.md5()
+    with open(fn, mode='rb') as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_all_urls(session, base_url=BASE_URL):
     '''Get all URLs you've written in.'''
     try:
         from pyquery import PyQuery as pq
     except ImportError:
         raise ImportError('Downloading data requires pyquery')
-    r = session.get('https://750words.com/statistics/2000/01')
+    r = session.get(base_url + '/statistics/2000/01')
     month_page = pq(r.text)
 
     urls = []
     for e in month_page('td').find('a'):
         e = pq(e)
         if e.attr.href.startswith('/export'):
-            url = 'https://750words.com' + e.attr.href
+            url = base_url + e.attr.href
             if url not in urls:
                 urls.append(url)
     return urls
@@ -770,12 +2388,271 @@ def get_credentials_wxPython():
     raise AuthenticationError('Log in cancelled')
 
 
+def plan_downloads(urls, path, now=None):
+    '''Choose which of the export *urls* (from get_all_urls) need to be
+    downloaded to bring the export files in *path* up to date.
+
+    Past months can't change once they are over, so a month is only
+    downloaded if there is no export file for it yet, or if its export file
+    was saved before the month ended (e.g. the current month, or last month
+    if it was last downloaded before the end of the month).
+
+    Args:
+        - *urls*: list of export URLs ending in /year/month
+        - *path*: folder containing the export files
+        - *now*: datetime to plan for; defaults to now
+
+    Returns: list of the URLs to download, in the same order as *urls*
+
+    '''
+    if now is None:
+        now = datetime.datetime.now()
+    saved = {}
+    for fn in find_export_files(path):
+        saved[get_yeardate(fn)] = datetime.datetime.fromtimestamp(os.path.getmtime(fn))
+    plan = []
+    for url in urls:
+        year, month = map(int, url.split('/')[-2:])
+        if month == 12:
+            month_end = datetime.datetime(year + 1, 1, 1)
+        else:
+            month_end = datetime.datetime(year, month + 1, 1)
+        saved_at = saved.get('%d-%02d' % (year, month))
+        if saved_at is None or saved_at < month_end or now < month_end:
+            plan.append(url)
+    return plan
+
+
+class token_bucket(object):
+    '''Rate limiter which allows *rate* requests per second on average, and
+    bursts of up to *capacity* requests at once. Safe to share between
+    threads.
+
+    Methods:
+        - *acquire*
+
+    '''
+    def __init__(self, rate=0.1, capacity=1):
+        if rate <= 0:
+            raise ValueError('The rate must be more than 0 requests per second')
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Wait until a request is allowed, and use it up.'''
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class export_fetcher(object):
+    '''Download export files with a pool of threads, keeping to a polite
+    request budget.
+
+    Every request (including retries) waits for the shared token_bucket, so
+    the budget holds however many threads there are. Failed requests are
+    retried with exponential backoff (or after the Retry-After time the
+    server asks for). The ETag and Last-Modified headers of each export are
+    kept in ``DOWNLOAD_STATE_FN`` in *path*, so that months which haven't
+    changed since the last run are answered with 304 Not Modified instead of
+    being sent again. Each month is written (atomically, see write_file) as
+    soon as it arrives, so an interrupted run picks up where it left off
+    (see plan_downloads).
+
+    Args:
+        - *session*: logged in requests.Session; each thread gets a copy of
+          its cookies and headers
+        - *path*: folder to save export files in, or None to not save them
+        - *rate*: requests per second
+        - *burst*: number of requests which can be made at once after a
+          quiet spell
+        - *workers*: number of threads
+        - *retries*: number of times to retry a failed request
+        - *backoff*: seconds to wait before the first retry; doubled for
+          each retry after that
+
+    Attributes:
+        - *failed*: list of (url, error) for the downloads which failed
+        - *not_modified*: list of URLs whose exports hadn't changed
+
+    Methods:
+        - *fetch*
+
+    '''
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, session, path=None, rate=0.1, burst=1, workers=2,
+                 retries=4, backoff=2.):
+        if workers < 1:
+            raise ValueError('There must be at least one worker')
+        self.session = session
+        self.path = path
+        self.bucket = token_bucket(rate, burst)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.failed = []
+        self.not_modified = []
+        self.state = {}
+        self.state_fn = None
+        if path:
+            self.state_fn = os.path.join(path, DOWNLOAD_STATE_FN)
+            try:
+                with open(self.state_fn, mode='rb') as f:
+                    self.state = pickle.load(f)
+            except Exception:
+                pass
+        self.lock = threading.Lock()
+
+    def fetch(self, urls):
+        '''Download the export *urls*, yielding (year, month, text) for each
+        one as soon as it arrives (not necessarily in order). Months which
+        haven't changed since they were saved, or couldn't be downloaded,
+        are left out.'''
+        import Queue
+        todo = Queue.Queue()
+        for url in urls:
+            todo.put(url)
+        done = Queue.Queue()
+        threads = []
+        for i in range(min(self.workers, len(urls))):
+            thread = threading.Thread(target=self.work, args=(todo, done))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for i in range(len(urls)):
+            result = done.get()
+            if result is not None:
+                yield result
+        for thread in threads:
+            thread.join()
+
+    def work(self, todo, done):
+        '''Download URLs from the queue *todo* until it is empty, putting
+        the results in the queue *done*.'''
+        import Queue
+        import requests
+        session = requests.Session()
+        session.headers.update(self.session.headers)
+        session.cookies.update(self.session.cookies)
+        while True:
+            try:
+                url = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                done.put(self.download(session, url))
+            except Exception as e:
+                print 'Failed to download %s (%s)' % (url, e)
+                with self.lock:
+                    self.failed.append((url, e))
+                done.put(None)
+
+    def download(self, session, url):
+        '''Download one export *url*, returning (year, month, text), or None
+        if it hasn't changed since it was saved.'''
+        import requests
+        year, month = map(int, url.split('/')[-2:])
+        headers = {}
+        saved = self.state.get(url, {})
+        if self.path and os.path.exists(export_filename(year, month, self.path)):
+            if saved.get('etag'):
+                headers['If-None-Match'] = saved['etag']
+            if saved.get('last_modified'):
+                headers['If-Modified-Since'] = saved['last_modified']
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            wait = self.backoff * 2 ** attempt
+            try:
+                r = session.get(url, headers=headers)
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise
+            else:
+                if not r.status_code in self.retry_statuses:
+                    break
+                if attempt == self.retries:
+                    r.raise_for_status()
+                retry_after = r.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = int(retry_after)
+            print '  retrying %s in %d s...' % (url, wait)
+            time.sleep(wait)
+        if r.status_code == 304:
+            print '  %s has not changed' % url
+            fn = export_filename(year, month, self.path)
+            os.utime(fn, None)   # so plan_downloads knows it is up to date
+            with self.lock:
+                self.not_modified.append(url)
+            return None
+        r.raise_for_status()
+        print '  downloaded %s' % url
+        if self.path:
+            write_file(r.text, year, month, self.path)
+            with self.lock:
+                self.state[url] = {'etag': r.headers.get('ETag'),
+                                   'last_modified': r.headers.get('Last-Modified')}
+                self.save_state()
+        return year, month, r.text
+
+    def save_state(self):
+        '''Write the ETag and Last-Modified headers of the exports to the
+        state file.'''
+        try:
+            save_pickle(self.state, self.state_fn)
+        except (IOError, OSError) as e:
+            print 'Warning: could not write %s (%s)' % (self.state_fn, e)
+
+
+def export_filename(year, month, path):
+    '''Return the filename of the export file for *year*, *month* in *path*.'''
+    return os.path.join(path, '750 Words-export-%s-%02.0f.txt' % (months_inv[month], year))
+
+
 def write_file(text, year, month, path):
-    fn = '750 Words-export-%s-%02.0f.txt' % (months_inv[month], year)
-    full_fn = os.path.join(path, fn)
+    '''Save the export *text* for *year*, *month* in *path*.
+
+    The text is written to a temporary file first, so an interrupted
+    download never leaves a partial export file behind.
+
+    '''
+    full_fn = export_filename(year, month, path)
+    tmp_fn = os.path.join(path, '.' + os.path.basename(full_fn) + '.tmp')
     print '  saving to %s...' % full_fn
-    with codecs.open(full_fn, mode='w', encoding='utf-8') as f:
+    with codecs.open(tmp_fn, mode='w', encoding='utf-8') as f:
         f.write(text)
+    if os.path.exists(full_fn):
+        os.remove(full_fn)
+    os.rename(tmp_fn, full_fn)
+
+
+wordlists = {}
+
+
+def open_wordlist(fn):
+    '''Return the list of words in *fn*, one per line.
+
+    The words are kept in memory and only read again once *fn* changes, so
+    stats for many entries don't each re-read the stop words file.
+
+    '''
+    mtime = os.path.getmtime(fn)
+    if not fn in wordlists or wordlists[fn][0] != mtime:
+        with open(fn, mode='r') as f:
+            words = [line.strip('\n').strip() for line in f.readlines()]
+        wordlists[fn] = (mtime, words)
+    return list(wordlists[fn][1])
 
 
 def count_words(text):
@@ -822,11 +2699,297 @@ def freqdict(txt, wordfunc=None):
     return wdict
 
 
-def wordfreqpairs(wfdict):
-    '''Turns frequency dict into an ordered list of (word, freq) tuples.'''
+def analyse_tokens(text, wordfunc=None, lexicons=None):
+    '''Calculate the per-word statistics used by stats in a single pass
+    over the words in *text*.
+
+    Each distinct word is only looked up in the lexicons once, however many
+    times it occurs. The Moby data isn't used here (see syllable_lengths and
+    pos_counts), so it is only loaded by the statistics which need it.
+
+    Returns: a dictionary with keys:
+        - 'lwords': list of lowercase words
+        - 'word_lengths': list of the length of each word
+        - 'freqdict': word form frequencies, as for freqdict
+        - the label of each of the *lexicons* (by default ``lexicons``):
+          number of words found
+
+    '''
+    if wordfunc is None:
+        wordfunc = lambda x: x
+    if lexicons is None:
+        lexicons = globals()['lexicons']
+    lwords = []
+    word_lengths = []
+    wdict = defaultdict(int)
+    lexmatcher = get_lexicon_matcher(lexicons)
+    lexcounts = [0] * len(lexicons)
+    lookups = {}
+    for word in text.split():
+        lword = word.lower()
+        lwords.append(lword)
+        word_lengths.append(len(lword))
+        wdict[wordfunc(word)] += 1
+        try:
+            wlexcounts = lookups[lword]
+        except KeyError:
+            wlexcounts = lookups[lword] = lexmatcher.counts(lword)
+        for i in wlexcounts:
+            lexcounts[i] += wlexcounts[i]
+    results = {'lwords': lwords, 'word_lengths': word_lengths,
+               'freqdict': wdict}
+    for (label, words), count in zip(lexicons, lexcounts):
+        results[label] = count
+    return results
+
+
+def syllable_lengths(lwords):
+    '''Return a list of the number of syllables of each of the lowercase
+    words *lwords* found in the Moby hyphenation data. Each distinct word is
+    only looked up once, and the parts-of-speech data isn't loaded.'''
+    import moby
+    lookups = {}
+    lengths = []
+    for lword in lwords:
+        try:
+            nsyllables = lookups[lword]
+        except KeyError:
+            try:
+                nsyllables = len(moby.syllables[lword])
+            except KeyError:
+                nsyllables = None
+            lookups[lword] = nsyllables
+        if nsyllables is not None:
+            lengths.append(nsyllables)
+    return lengths
+
+
+def pos_counts(lwords):
+    '''Return a dictionary of the number of the lowercase words *lwords*
+    of each part of speech in the Moby data. Each distinct word is only
+    looked up once, and the hyphenation data isn't loaded.'''
+    import moby
+    poses = dict((pos, 0) for pos in moby.postypes.values())
+    lookups = {}
+    for lword in lwords:
+        try:
+            wposes = lookups[lword]
+        except KeyError:
+            try:
+                wposes = moby.pos[lword]
+            except KeyError:
+                wposes = ()
+            lookups[lword] = wposes
+        for wpos in wposes:
+            poses[wpos] += 1
+    return poses
+
+
+class matcher(object):
+    '''Find which of a list of patterns occur in a string, using an
+    Aho-Corasick automaton, so the time taken depends on the length of the
+    string and not on the number of patterns.
+
+    Args:
+        - *patterns*: list of strings
+
+    Methods:
+        - *matches*
+
+    '''
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto = [{}]
+        out = [[]]
+        for i, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                if not char in goto[node]:
+                    goto.append({})
+                    out.append([])
+                    goto[node][char] = len(goto) - 1
+                node = goto[node][char]
+            out[node].append(i)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and not char in goto[f]:
+                    f = fail[f]
+                if node:
+                    fail[child] = goto[f].get(char, 0)
+                out[child] = out[child] + out[fail[child]]
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+    def matches(self, text):
+        '''Return the set of indices of the patterns which occur in *text*.'''
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        found = set(out[0])
+        node = 0
+        for char in text:
+            while node and not char in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class lexicon_matcher(matcher):
+    '''Count the words of several lexicons found in a string (see
+    ``lexicons``) with a single matcher.
+
+    Args:
+        - *lexicons*: list of (label, words) pairs
+
+    Methods:
+        - *counts*
+
+    '''
+    def __init__(self, lexicons):
+        patterns = []
+        self.lexicon_index = []
+        for i, (label, words) in enumerate(lexicons):
+            patterns += list(words)
+            self.lexicon_index += [i] * len(words)
+        matcher.__init__(self, patterns)
+
+    def counts(self, text):
+        '''Return a dictionary of lexicon index -> number of different
+        words from that lexicon in *text*, for the lexicons found.'''
+        counts = {}
+        for i in self.matches(text):
+            j = self.lexicon_index[i]
+            counts[j] = counts.get(j, 0) + 1
+        return counts
+
+
+lexicon_matchers = {}
+
+
+def get_lexicon_matcher(lexicons):
+    '''Return a lexicon_matcher for *lexicons*, re-using the one made
+    before for the same lexicons if there is one.'''
+    key = tuple((label, tuple(words)) for label, words in lexicons)
+    if not key in lexicon_matchers:
+        lexicon_matchers[key] = lexicon_matcher(lexicons)
+    return lexicon_matchers[key]
+
+
+def wordfreqpairs(wfdict, n=None):
+    '''Turns frequency dict into an ordered list of (word, freq) tuples.
+
+    If *n* is given, only the *n* most frequent words are returned, which is
+    much quicker than sorting them all when *n* is small.
+
+    '''
+    if n is not None:
+        return heapq.nlargest(n, wfdict.iteritems(), key=lambda x: x[1])
     return sorted(wfdict.iteritems(), key=lambda x: x[1], reverse=True)
 
 
+class spacesaving(object):
+    '''Approximate word frequencies in a fixed amount of memory, using the
+    Space-Saving algorithm (Metwally et al., 2005).
+
+    At most *capacity* words are counted. When a new word turns up and there
+    is no room left, the word with the lowest count is replaced by it and the
+    new word inherits that count, which is remembered as its possible error.
+    Any word which occurs more than N / *capacity* times in N words is
+    guaranteed to be counted, and counts are never underestimated.
+
+    Args:
+        - *capacity*: maximum number of words to count
+
+    Methods:
+        - *add*
+        - *update*
+        - *wordfreqpairs*
+
+    '''
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.n = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, word, n=1):
+        '''Count *n* more occurrences of *word*.'''
+        self.n += n
+        if word in self.counts:
+            self.counts[word] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[word] = n
+            self.errors[word] = 0
+        else:
+            # Entries in the heap are (count, word), and go stale when the
+            # word's count changes; skip those until a current one is found.
+            while True:
+                count, old = heapq.heappop(self.heap)
+                if self.counts.get(old) == count:
+                    break
+            del self.counts[old]
+            del self.errors[old]
+            self.counts[word] = count + n
+            self.errors[word] = count
+        heapq.heappush(self.heap, (self.counts[word], word))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, w) for w, count in self.counts.iteritems()]
+            heapq.heapify(self.heap)
+
+    def update(self, words):
+        '''Count each of *words*.'''
+        for word in words:
+            self.add(word)
+
+    def wordfreqpairs(self, n=None):
+        '''Return a list of (word, estimated freq) tuples for the *n* most
+        frequent words (or all counted words), most frequent first.'''
+        return wordfreqpairs(self.counts, n)
+
+    def error(self, word):
+        '''Return the most by which the count of *word* may be too high.'''
+        return self.errors[word]
+
+
+def approx_wordfreqpairs(entries, n=20, capacity=10000, clean_func='auto',
+                         wordfunc=None):
+    '''Return the *n* most frequent words in *entries*, with estimated
+    frequencies, using a fixed amount of memory (see spacesaving).
+
+    Args:
+        - *entries*: list of dictionaries for each entry, or an iterator over
+          them such as iter_entries()
+        - *n*: number of words to return
+        - *capacity*: maximum number of words to count at once
+        - *clean_func*, *wordfunc*: as for stats
+
+    Returns: list of (word, estimated freq) tuples, most frequent first
+
+    '''
+    if clean_func is None:
+        clean_func = lambda x: x
+    elif clean_func == 'auto':
+        clean_func = clean_for_stats
+    if wordfunc is None:
+        wordfunc = lambda x: x
+    counter = spacesaving(capacity)
+    for e in entries:
+        counter.update(wordfunc(w) for w in clean_func(e['text']).split())
+    return counter.wordfreqpairs(n)
+
+
 def wordle(fdict):
     pass
     
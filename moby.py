@@ -1,11 +1,21 @@
 from collections import defaultdict
+import mmap
 import os
+import struct
+import threading
+import zlib
 
 MOBY_ROOT = 'Moby'
 HYPH_FN = os.path.join(MOBY_ROOT, 'mhyph', 'mhyph.txt')
 POS_FN = os.path.join(MOBY_ROOT, 'mpos', 'mobyposi.i')
 FREQ_FN = os.path.join(MOBY_ROOT, 'mwords', '10001fr.equ')
 
+# Compiled versions of the above, written by compile_lexicons().
+HYPH_LEX_FN = os.path.splitext(HYPH_FN)[0] + '.lex'
+POS_LEX_FN = os.path.splitext(POS_FN)[0] + '.lex'
+FREQ_LEX_FN = os.path.splitext(FREQ_FN)[0] + '.lex'
+LEX_MAGIC = 'MOBYLEX1'
+
 postypes = {'N': 'noun',
             'p': 'plural',
             'h': 'noun phrase',
@@ -24,6 +34,33 @@ postypes = {'N': 'noun',
 pos_parse_func = lambda codes: [postypes[char] for char in codes]
 POS_DELIM = chr(215)
 LINE_BREAK = chr(13)
+# The Moby files come from the Macintosh, so any accented words in them
+# are in Mac OS Roman.
+MOBY_ENCODING = 'mac_roman'
+
+
+def moby_word(word):
+    '''Return *word* as the Moby tables spell it: a Mac OS Roman byte string.
+
+    *word* can be unicode, a UTF-8 byte string (as read from export files),
+    or already in Mac OS Roman. Returns None if the word can't be written in
+    Mac OS Roman, so it can't be in the tables.
+
+    '''
+    if isinstance(word, str):
+        try:
+            word.decode('ascii')
+            return word
+        except UnicodeDecodeError:
+            pass
+        try:
+            word = word.decode('utf-8')
+        except UnicodeDecodeError:
+            return word
+    try:
+        return word.encode(MOBY_ENCODING)
+    except UnicodeEncodeError:
+        return None
 
 
 def load_hyphenation(hyphfn=HYPH_FN, kind='syllables'):
@@ -117,6 +154,266 @@ def get_by_freq(freqfn=FREQ_FN):
     return flist
 
 
-syllables = load_hyphenation()
-pos = load_partsofspeech()
-freq = get_by_freq()
\ No newline at end of file
+class lexicon(object):
+    '''Read-only dictionary served from a compiled lexicon file.
+
+    The file is memory-mapped, so looking up a word only touches the pages
+    it needs, and several processes using the same file share its pages.
+    Words are found with a hash table stored in the file.
+
+    File layout (all integers are little-endian unsigned 32-bit):
+        - *LEX_MAGIC*, then the number of words *n* and hash slots *m*
+        - *n* + 1 offsets into the data for each word, in the original order
+        - *m* hash slots, each 0 (empty) or the index of a word plus one
+        - data: for each word, the word, a null byte, and its value
+
+    Args:
+        - *fn*: filename written by write_lexicon
+        - *decode*: function to convert the stored value string, optional
+
+    '''
+    def __init__(self, fn, decode=None):
+        self.fn = fn
+        self.decode = decode
+        with open(fn, mode='rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(LEX_MAGIC)] != LEX_MAGIC:
+            raise ValueError('%s is not a compiled lexicon file' % fn)
+        self.n, self.nslots = struct.unpack_from('<II', self.mm, len(LEX_MAGIC))
+        self.offsets_pos = len(LEX_MAGIC) + 8
+        self.slots_pos = self.offsets_pos + (self.n + 1) * 4
+        self.data_pos = self.slots_pos + self.nslots * 4
+
+    def _item(self, i):
+        start, end = struct.unpack_from('<II', self.mm, self.offsets_pos + i * 4)
+        return self.mm[self.data_pos + start:self.data_pos + end]
+
+    def _find(self, word):
+        if isinstance(word, unicode):
+            try:
+                word = word.encode(MOBY_ENCODING)
+            except UnicodeEncodeError:
+                return None
+        elif not isinstance(word, str):
+            return None
+        prefix = word + '\0'
+        slot = (zlib.crc32(word) & 0xffffffff) % self.nslots
+        while True:
+            i, = struct.unpack_from('<I', self.mm, self.slots_pos + slot * 4)
+            if not i:
+                return None
+            start, end = struct.unpack_from('<II', self.mm, self.offsets_pos + (i - 1) * 4)
+            start += self.data_pos
+            if self.mm[start:start + len(prefix)] == prefix:
+                return self.mm[start + len(prefix):self.data_pos + end]
+            slot = (slot + 1) % self.nslots
+
+    def __getitem__(self, word):
+        value = self._find(word)
+        if value is None:
+            raise KeyError(word)
+        if self.decode:
+            return self.decode(value)
+        return value
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self._item(i).split('\0', 1)[0]
+
+    def keys(self):
+        return list(self)
+
+
+class wordlist(object):
+    '''Read-only list of the words in a compiled lexicon file, in their
+    original order.'''
+    def __init__(self, fn):
+        self.lexicon = lexicon(fn)
+
+    def __len__(self):
+        return len(self.lexicon)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('wordlist index out of range')
+        return self.lexicon._item(index).split('\0', 1)[0]
+
+    def __iter__(self):
+        return iter(self.lexicon)
+
+    def __contains__(self, word):
+        return word in self.lexicon
+
+
+def write_lexicon(items, fn):
+    '''Write a compiled lexicon file (see the lexicon class).
+
+    Args:
+        - *items*: list of (word, value) string pairs
+        - *fn*: filename to write to
+
+    '''
+    n = len(items)
+    nslots = max(2 * n, 1)
+    slots = [0] * nslots
+    offsets = [0]
+    data = []
+    for i, (word, value) in enumerate(items):
+        data.append(word + '\0' + value)
+        offsets.append(offsets[-1] + len(data[-1]))
+        slot = (zlib.crc32(word) & 0xffffffff) % nslots
+        while slots[slot]:
+            slot = (slot + 1) % nslots
+        slots[slot] = i + 1
+    print 'Writing %d words to %s' % (n, fn)
+    with open(fn, mode='wb') as f:
+        f.write(LEX_MAGIC)
+        f.write(struct.pack('<II', n, nslots))
+        f.write(struct.pack('<%dI' % (n + 1), *offsets))
+        f.write(struct.pack('<%dI' % nslots, *slots))
+        f.write(''.join(data))
+
+
+def compile_lexicons():
+    '''Compile the Moby hyphenation, parts-of-speech and frequency data
+    into lexicon files, which are much quicker to load.'''
+    hyphen_char = chr(165)
+    hdict = load_hyphenation()
+    write_lexicon([(word, hyphen_char.join(parts)) for word, parts in hdict.items()],
+                  HYPH_LEX_FN)
+    poscodes = dict((v, k) for k, v in postypes.items())
+    posdict = load_partsofspeech()
+    write_lexicon([(word, ''.join(poscodes[p] for p in poses))
+                   for word, poses in posdict.items()], POS_LEX_FN)
+    if os.path.exists(FREQ_FN):
+        write_lexicon([(word, '') for word in get_by_freq()], FREQ_LEX_FN)
+
+
+def lexicon_is_current(lexfn, fn):
+    '''Check whether compiled lexicon *lexfn* exists and is newer than the
+    data file *fn* it was compiled from.'''
+    if not os.path.exists(lexfn):
+        return False
+    return not os.path.exists(fn) or os.path.getmtime(lexfn) >= os.path.getmtime(fn)
+
+
+def load_syllables():
+    '''Return the syllables of each word, from the compiled lexicon if
+    it is up to date, otherwise from the hyphenation data.'''
+    if lexicon_is_current(HYPH_LEX_FN, HYPH_FN):
+        return lexicon(HYPH_LEX_FN, decode=lambda value: value.split(chr(165)))
+    return load_hyphenation()
+
+
+def load_pos():
+    '''Return the parts of speech of each word, from the compiled lexicon
+    if it is up to date, otherwise from the parts-of-speech data.'''
+    if lexicon_is_current(POS_LEX_FN, POS_FN):
+        return lexicon(POS_LEX_FN, decode=pos_parse_func)
+    return load_partsofspeech()
+
+
+def load_freq():
+    '''Return the list of words by frequency, from the compiled lexicon if
+    it is up to date, otherwise from the frequency data.'''
+    if lexicon_is_current(FREQ_LEX_FN, FREQ_FN):
+        return wordlist(FREQ_LEX_FN)
+    return get_by_freq()
+
+
+class lazy_table(object):
+    '''Stand-in for a Moby table which is only loaded the first time it is
+    used. It can be used just like the dictionary or list it stands in for.
+
+    Loading is thread-safe: if several threads use the table at once, it is
+    still only loaded once.
+
+    Args:
+        - *load_func*: function which returns the table
+
+    '''
+    def __init__(self, load_func):
+        self.load_func = load_func
+        self.lock = threading.Lock()
+        self.table = None
+
+    def load(self):
+        '''Load the table if it hasn't been already, and return it.'''
+        if self.table is None:
+            with self.lock:
+                if self.table is None:
+                    self.table = self.load_func()
+        return self.table
+
+    @property
+    def loaded(self):
+        return self.table is not None
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            word = moby_word(key)
+            if word is None:
+                raise KeyError(key)
+            key = word
+        return self.load()[key]
+
+    def __contains__(self, key):
+        if isinstance(key, basestring):
+            key = moby_word(key)
+            if key is None:
+                return False
+        return key in self.load()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return len(self.load())
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __getattr__(self, name):
+        if name in ('load_func', 'lock', 'table'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+syllables = lazy_table(load_syllables)
+pos = lazy_table(load_pos)
+freq = lazy_table(load_freq)
+
+
+def preload(tables=('syllables', 'pos', 'freq')):
+    '''Load the Moby tables now rather than when they are first used, e.g.
+    before starting a server.
+
+    Args:
+        - *tables*: names of the tables to load
+
+    '''
+    for name in tables:
+        globals()[name].load()
+
+
+if __name__ == '__main__':
+    compile_lexicons()
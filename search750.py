@@ -0,0 +1,505 @@
+'''Full-text search of your 750 words entries.
+
+Build an index of the entries returned by ``m750.read_local_750words()``::
+
+    >>> import m750, search750
+    >>> text, entries = m750.read_local_750words()
+    >>> index = search750.text_index(entries)
+    >>> for result in index.search('coffee -tea'):
+    ...     print result['date'], index.snippet(entries[result['entry']]['text'], result)
+
+Queries are made up of:
+
+    - words, all of which must occur in an entry: ``coffee morning``
+    - phrases in double quotes, which must occur as written: ``"went for a walk"``
+    - words or phrases prefixed with ``-``, which must not occur: ``-work``
+    - ``OR`` between groups of the above, any of which can match:
+      ``coffee OR tea``
+
+Matching entries are ranked by BM25 score.
+
+For keyword-in-context listings, a concordance finds every occurrence of a
+word or phrase (or, ending with ``*``, of words starting with it) with a few
+words either side, in date order::
+
+    >>> conc = search750.concordance(entries)
+    >>> print search750.format_kwic(conc.kwic('went for a walk*', width=5))
+
+``open_index()`` and ``open_concordance()`` keep them on disk next to the
+export files, so they are only rebuilt when the export files change.
+
+'''
+from __future__ import division
+
+from array import array
+import bisect
+import cgi
+import math
+import os
+import re
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import m750
+
+
+INDEX_FN = '.m750-index.pickle'
+CONCORDANCE_FN = '.m750-concordance.pickle'
+INDEX_VERSION = 3
+
+word_re = re.compile(r"\w+(?:'\w+)*", re.UNICODE)
+query_re = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def to_unicode(text):
+    '''Return *text* as unicode, decoding it from UTF-8 if need be.'''
+    if isinstance(text, unicode):
+        return text
+    return text.decode('utf-8', 'replace')
+
+
+def tokenize(text):
+    '''Return a list of the lowercase words in *text* (unicode, or UTF-8).'''
+    return word_re.findall(to_unicode(text).lower())
+
+
+class text_index(object):
+    '''Positional inverted index of entries.
+
+    For each word, the index stores the entries it occurs in and its
+    positions (word numbers) in each of them, so that phrases can be found
+    without looking at the text.
+
+    Args:
+        - *entries*: list of dictionaries for each entry, or an iterator over
+          them such as m750.iter_entries()
+
+    Attributes:
+        - *dates*: list of the date of each entry
+        - *lengths*: array of the number of words in each entry
+        - *postings*: dictionary of word -> (*docs*, *starts*, *positions*)
+          arrays, where the positions of the word in entry ``docs[i]`` are
+          ``positions[starts[i]:starts[i + 1]]``
+
+    Methods:
+        - *search*
+        - *snippet*
+
+    '''
+    def __init__(self, entries):
+        self.dates = []
+        self.lengths = array('i')
+        building = {}
+        for doc, e in enumerate(entries):
+            self.dates.append(e['date'])
+            words = tokenize(e['text'])
+            self.lengths.append(len(words))
+            for pos, word in enumerate(words):
+                try:
+                    docs, positions = building[word]
+                except KeyError:
+                    docs, positions = building[word] = ([], [])
+                if not docs or docs[-1] != doc:
+                    docs.append(doc)
+                    positions.append(array('i'))
+                positions[-1].append(pos)
+        self.postings = {}
+        for word, (docs, positions) in building.iteritems():
+            starts = array('i', [0])
+            flat = array('i')
+            for doc_positions in positions:
+                flat.extend(doc_positions)
+                starts.append(len(flat))
+            self.postings[word] = (array('i', docs), starts, flat)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def positions(self, word):
+        '''Return a dictionary of entry number -> list of positions of *word*.'''
+        if not word in self.postings:
+            return {}
+        docs, starts, flat = self.postings[word]
+        return dict((doc, flat[starts[i]:starts[i + 1]])
+                    for i, doc in enumerate(docs))
+
+    def phrase_positions(self, words):
+        '''Return a dictionary of entry number -> list of the positions at
+        which the phrase *words* (a list of words) starts.'''
+        if not words:
+            return {}
+        found = dict((doc, set(pos)) for doc, pos in self.positions(words[0]).items())
+        for offset, word in enumerate(words[1:], 1):
+            if not found:
+                break
+            word_positions = self.positions(word)
+            for doc in found.keys():
+                if doc in word_positions:
+                    following = set(p - offset for p in word_positions[doc])
+                    found[doc] &= following
+                if not doc in word_positions or not found[doc]:
+                    del found[doc]
+        return dict((doc, sorted(pos)) for doc, pos in found.items())
+
+    def search(self, query, limit=50):
+        '''Find the entries matching *query* (see the module docstring).
+
+        Args:
+            - *query*: the query
+            - *limit*: the most results to return, or None for all of them
+
+        Returns: list of dictionaries, best match first, with keys:
+            - 'entry': entry number
+            - 'date': datetime of the entry
+            - 'score': BM25 score
+            - 'positions': list of the positions of the matching words
+            - 'length': number of words matched at each position
+
+        '''
+        clauses = parse_query(query)
+        avg_length = sum(self.lengths) / len(self.lengths) if len(self) else 0
+        results = {}
+        for clause in clauses:
+            matches = None
+            excluded = set()
+            hits = {}
+            for negated, words in clause:
+                found = self.phrase_positions(words)
+                if negated:
+                    excluded.update(found)
+                    continue
+                if matches is None:
+                    matches = set(found)
+                else:
+                    matches &= set(found)
+                # The number of entries containing the word or phrase.
+                df = len(found)
+                for doc, pos in found.items():
+                    hits.setdefault(doc, []).append((words, pos, df))
+            if not matches:
+                continue
+            matches -= excluded
+            for doc in matches:
+                score = 0
+                positions = []
+                for words, pos, df in hits[doc]:
+                    score += self.score(doc, len(pos), df, avg_length)
+                    positions += [(p, len(words)) for p in pos]
+                if not doc in results or score > results[doc]['score']:
+                    positions.sort()
+                    results[doc] = {'entry': doc, 'date': self.dates[doc],
+                                    'score': score,
+                                    'positions': [p for p, n in positions],
+                                    'length': [n for p, n in positions]}
+        ranked = sorted(results.values(), key=lambda r: (-r['score'], r['date']))
+        return ranked[:limit]
+
+    def score(self, doc, tf, df, avg_length):
+        '''Return the BM25 score of a word or phrase occurring *tf* times in
+        entry *doc*, and in *df* entries altogether.'''
+        n = len(self)
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        norm = 1 - B + B * self.lengths[doc] / avg_length if avg_length else 1
+        return idf * tf * (K1 + 1) / (tf + K1 * norm)
+
+    def snippet(self, text, result, context=12, highlight=('<b>', '</b>')):
+        '''Return an HTML snippet of *text* (the text of the entry in
+        *result*, from search) around the first match, with the matching
+        words highlighted. Returns unicode.'''
+        text = to_unicode(text)
+        matches = list(word_re.finditer(text))
+        if not matches or not result['positions']:
+            return cgi.escape(text[:200])
+        first = result['positions'][0]
+        start = max(first - context, 0)
+        end = min(first + context, len(matches) - 1)
+        marked = set()
+        for pos, length in zip(result['positions'], result['length']):
+            marked.update(range(pos, pos + length))
+        html = []
+        prev_end = matches[start].start()
+        for i in range(start, end + 1):
+            m = matches[i]
+            html.append(cgi.escape(text[prev_end:m.start()]))
+            if i in marked:
+                html.append(highlight[0] + cgi.escape(m.group()) + highlight[1])
+            else:
+                html.append(cgi.escape(m.group()))
+            prev_end = m.end()
+        snippet = ' '.join(''.join(html).split())
+        if start > 0:
+            snippet = '... ' + snippet
+        if end < len(matches) - 1:
+            snippet += ' ...'
+        return snippet
+
+
+class concordance(object):
+    '''Keyword-in-context lookups using a suffix array of the words of all
+    the entries.
+
+    The words of every entry (as from tokenize) are numbered in alphabetical
+    order and joined into one stream, with a separator after each entry so
+    that phrases are never found running from one entry into the next. The
+    suffix array lists every position in the stream, sorted by the words
+    from that position onwards, so all the occurrences of a phrase (or of
+    words starting with some letters) are next to each other and are found
+    by binary search.
+
+    Args:
+        - *entries*: list of dictionaries for each entry, or an iterator over
+          them such as m750.iter_entries()
+
+    Attributes:
+        - *words*: alphabetical list of the distinct words (the first, '',
+          is the separator)
+        - *stream*: array of the word numbers of all the entries
+        - *starts*: array of the position in *stream* where each entry starts
+        - *suffixes*: the suffix array
+        - *dates*: list of the date of each entry
+        - *texts*: list of the text of each entry, as unicode
+
+    Methods:
+        - *find*
+        - *kwic*
+
+    '''
+    def __init__(self, entries):
+        self.dates = []
+        self.texts = []
+        tokens = []
+        for e in entries:
+            self.dates.append(e['date'])
+            text = to_unicode(e['text'])
+            self.texts.append(text)
+            tokens.append(tokenize(text))
+        self.words = [''] + sorted(set(w for words in tokens for w in words))
+        ids = dict((w, i) for i, w in enumerate(self.words))
+        self.stream = array('i')
+        self.starts = array('i')
+        for words in tokens:
+            self.starts.append(len(self.stream))
+            self.stream.extend(ids[w] for w in words)
+            self.stream.append(0)
+        self.suffixes = suffix_array(self.stream)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def find(self, query):
+        '''Return the positions in *stream* where *query* (a word or phrase,
+        optionally ending in ``*``) occurs, in order.'''
+        words = tokenize(query)
+        if not words:
+            return []
+        head = []
+        for word in words[:-1]:
+            i = bisect.bisect_left(self.words, word)
+            if i == len(self.words) or self.words[i] != word:
+                return []
+            head.append(i)
+        last = words[-1]
+        low = bisect.bisect_left(self.words, last)
+        if query.rstrip().endswith('*'):
+            high = bisect.bisect_left(self.words, last + u'\uffff')
+        elif low < len(self.words) and self.words[low] == last:
+            high = low + 1
+        else:
+            return []
+        start = self._bound(tuple(head + [low]))
+        end = self._bound(tuple(head + [high]))
+        return sorted(self.suffixes[start:end])
+
+    def _bound(self, key):
+        '''Return the first index into the suffix array whose suffix starts
+        with words >= *key* (a tuple of word numbers).'''
+        stream = self.stream
+        suffixes = self.suffixes
+        n = len(key)
+        lo, hi = 0, len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            p = suffixes[mid]
+            if tuple(stream[p:p + n]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def kwic(self, query, width=5):
+        '''Find every occurrence of *query* (see find) with *width* words of
+        context either side.
+
+        Returns: list of dictionaries, sorted by date and then position in
+        the entry, with keys:
+            - 'entry': entry number
+            - 'date': datetime of the entry
+            - 'position': word number in the entry
+            - 'left', 'match', 'right': text (unicode) before, of and after
+              the match
+
+        '''
+        length = len(tokenize(query))
+        results = []
+        spans = None
+        entry = None
+        for p in self.find(query):
+            i = bisect.bisect_right(self.starts, p) - 1
+            if i != entry:
+                entry = i
+                text = self.texts[i]
+                spans = [m.span() for m in word_re.finditer(text)]
+            pos = p - self.starts[i]
+            first = spans[pos][0]
+            last = spans[min(pos + length, len(spans)) - 1][1]
+            left = spans[max(pos - width, 0)][0]
+            right = spans[min(pos + length + width, len(spans)) - 1][1]
+            results.append({'entry': i, 'date': self.dates[i], 'position': pos,
+                            'left': ' '.join(text[left:first].split()),
+                            'match': ' '.join(text[first:last].split()),
+                            'right': ' '.join(text[last:right].split())})
+        results.sort(key=lambda r: (r['date'], r['position']))
+        return results
+
+
+def suffix_array(stream):
+    '''Return the suffix array of *stream* (a sequence of ints), as an
+    array('i') of positions.
+
+    Sorts by prefix doubling: after sorting by the first k numbers of each
+    suffix, each suffix is given its rank, and sorting by pairs of ranks
+    k apart sorts by the first 2k numbers, until every rank is different.
+    Uses numpy if it is available.
+
+    '''
+    n = len(stream)
+    if not n:
+        return array('i')
+    try:
+        import numpy as np
+    except ImportError:
+        pass
+    else:
+        rank = np.asarray(stream, dtype=np.int64)
+        k = 1
+        while True:
+            following = np.full(n, -1, dtype=np.int64)
+            following[:n - k] = rank[k:]
+            suffixes = np.lexsort((following, rank))
+            changed = ((rank[suffixes][1:] != rank[suffixes][:-1]) |
+                       (following[suffixes][1:] != following[suffixes][:-1]))
+            rank = np.empty(n, dtype=np.int64)
+            rank[suffixes] = np.concatenate(([0], np.cumsum(changed)))
+            if rank.max() == n - 1 or k >= n:
+                break
+            k *= 2
+        return array('i', suffixes.astype(np.int32).tostring())
+    rank = list(stream)
+    suffixes = range(n)
+    k = 1
+    while True:
+        key = lambda i: (rank[i], rank[i + k] if i + k < n else -1)
+        suffixes.sort(key=key)
+        new_rank = [0] * n
+        r = 0
+        previous = key(suffixes[0])
+        for i in suffixes:
+            current = key(i)
+            if current != previous:
+                r += 1
+                previous = current
+            new_rank[i] = r
+        rank = new_rank
+        if r == n - 1 or k >= n:
+            break
+        k *= 2
+    return array('i', suffixes)
+
+
+def format_kwic(results, width=40):
+    '''Return the results of concordance.kwic as lines of text, grouped
+    under the date of each entry, with the matches lined up.'''
+    lines = []
+    date = None
+    for r in results:
+        if r['date'] != date:
+            date = r['date']
+            lines.append(date.strftime('%a %d %b %Y'))
+        lines.append('  %s  %s  %s' % (r['left'][-width:].rjust(width), r['match'],
+                                       r['right'][:width]))
+    return '\n'.join(lines)
+
+
+def parse_query(query):
+    '''Parse a search query (see the module docstring).
+
+    Returns: a list of clauses, any of which may match. Each clause is a list
+    of (*negated*, *words*) items, where *words* is a list of one word or
+    the words of a phrase.
+
+    '''
+    clauses = [[]]
+    for m in query_re.finditer(query):
+        negated, phrase, word = m.groups()
+        if word == 'OR' and not negated:
+            clauses.append([])
+            continue
+        words = tokenize(phrase if phrase is not None else word)
+        if words:
+            clauses[-1].append((bool(negated), words))
+    return [clause for clause in clauses if any(not neg for neg, words in clause)]
+
+
+def open_index(path, entries, fns=None):
+    '''Return a text_index for *entries*, re-using the one stored next to
+    the export files in *path* if they haven't changed since it was built.
+
+    Args:
+        - *path*: folder containing the export files
+        - *entries*: list of entries read from those export files
+        - *fns*: the export filenames, if already known
+
+    '''
+    return open_stored(os.path.join(path, INDEX_FN), text_index, path, entries, fns)
+
+
+def open_concordance(path, entries, fns=None):
+    '''Return a concordance for *entries*, re-using the one stored next to
+    the export files in *path* (see open_index).'''
+    return open_stored(os.path.join(path, CONCORDANCE_FN), concordance, path,
+                       entries, fns)
+
+
+def open_stored(fn, cls, path, entries, fns=None):
+    '''Load the *cls* object pickled in *fn* if the export files in *path*
+    haven't changed since it was stored, otherwise build it from *entries*
+    and store it.'''
+    if fns is None:
+        fns = m750.find_export_files(path)
+    signature = [(os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f))
+                 for f in fns]
+    try:
+        with open(fn, mode='rb') as f:
+            version, stored_signature, obj = pickle.load(f)
+        if version == INDEX_VERSION and stored_signature == signature:
+            return obj
+    except Exception:
+        pass
+    obj = cls(entries)
+    tmp_fn = fn + '.tmp'
+    try:
+        with open(tmp_fn, mode='wb') as f:
+            pickle.dump((INDEX_VERSION, signature, obj), f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(fn):
+            os.remove(fn)
+        os.rename(tmp_fn, fn)
+    except (IOError, OSError) as e:
+        print 'Warning: could not write %s (%s)' % (fn, e)
+    return obj
@@ -0,0 +1,233 @@
+'''Tests for downloading export files (plan_downloads, token_bucket and
+export_fetcher), against a fake 750words.com server on this machine.
+
+Run with::
+
+    python -m unittest test_download
+
+'''
+import BaseHTTPServer
+import datetime
+import hashlib
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+import m750
+
+try:
+    import requests
+    import pyquery
+except ImportError:
+    requests = None
+
+
+def recent_months(n, now=None):
+    '''Return the last *n* (year, month) pairs up to and including this
+    month, oldest first.'''
+    if now is None:
+        now = datetime.datetime.now()
+    year, month = now.year, now.month
+    months = []
+    for i in range(n):
+        months.insert(0, (year, month))
+        month -= 1
+        if not month:
+            year, month = year - 1, 12
+    return months
+
+
+def export_text(year, month):
+    '''Return the text of a fake export file with one entry.'''
+    return (u'------ ENTRY ------\nDate: %d-%02d-01\nWords: 4\nMinutes: 2\n\n'
+            u'coffee at the caf\xe9\n' % (year, month))
+
+
+class fake_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answers the requests download_750words makes, like 750words.com.'''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, status=200, headers=()):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply(u'THIS MONTH', headers=[('Set-Cookie', 'session=1; Path=/')])
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith('/statistics/'):
+            links = ''.join('<td><a href="/export/%d/%d">%d</a></td>' % (y, m, m)
+                            for y, m in server.months)
+            return self.reply(u'<table><tr>%s</tr></table>' % links)
+        if not self.path.startswith('/export/'):
+            return self.reply(u'Not found', 404)
+        year, month = map(int, self.path.split('/')[-2:])
+        with server.lock:
+            server.requests.append(((year, month), self.headers.get('If-None-Match')))
+        if (year, month) in server.down:
+            return self.reply(u'Busy', 503, headers=[('Retry-After', '0')])
+        text = export_text(year, month)
+        etag = '"%s"' % hashlib.md5(text.encode('utf-8')).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            return self.reply(u'', 304)
+        self.reply(text, headers=[('ETag', etag)])
+
+
+class fake_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Fake 750words.com with an export for each of *months*.
+
+    Attributes:
+        - *url*: base URL of the server
+        - *requests*: list of ((year, month), If-None-Match header) for each
+          export request
+        - *down*: set of (year, month) whose exports fail with 503
+
+    '''
+    daemon_threads = True
+
+    def __init__(self, months):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), fake_handler)
+        self.months = months
+        self.requests = []
+        self.down = set()
+        self.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class test_plan_downloads(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def save(self, year, month, saved_at):
+        fn = m750.export_filename(year, month, self.path)
+        with open(fn, mode='w') as f:
+            f.write(export_text(year, month).encode('utf-8'))
+        t = time.mktime(saved_at.timetuple())
+        os.utime(fn, (t, t))
+
+    def test_only_missing_and_unfinished_months(self):
+        now = datetime.datetime(2013, 3, 15)
+        urls = ['%s/export/2013/%d' % (m750.BASE_URL, month) for month in (1, 2, 3)]
+        self.assertEqual(m750.plan_downloads(urls, self.path, now=now), urls)
+        # January was saved after it ended, February before.
+        self.save(2013, 1, datetime.datetime(2013, 2, 2))
+        self.save(2013, 2, datetime.datetime(2013, 2, 20))
+        self.save(2013, 3, datetime.datetime(2013, 3, 14))
+        self.assertEqual(m750.plan_downloads(urls, self.path, now=now), urls[1:])
+
+
+class test_token_bucket(unittest.TestCase):
+    def test_rate(self):
+        bucket = m750.token_bucket(rate=20, capacity=1)
+        start = time.time()
+        for i in range(5):
+            bucket.acquire()
+        # The first request is allowed at once, then one every 0.05 s.
+        self.assertTrue(0.15 <= time.time() - start < 1)
+
+    def test_shared_between_threads(self):
+        bucket = m750.token_bucket(rate=20, capacity=1)
+        start = time.time()
+        threads = [threading.Thread(target=bucket.acquire) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(0.15 <= time.time() - start < 1)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, m750.token_bucket, 0)
+
+
+class test_export_fetcher(unittest.TestCase):
+    def test_no_workers(self):
+        self.assertRaises(ValueError, m750.export_fetcher, None, workers=0)
+
+
+@unittest.skipIf(requests is None, 'downloading requires requests and pyquery')
+class test_download(unittest.TestCase):
+    def setUp(self):
+        self.months = recent_months(6)
+        self.server = fake_server(self.months)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def download(self):
+        return m750.download_750words(email='me@example.com', password='secret',
+                                      download=self.path, current=False,
+                                      base_url=self.server.url, rate=1000, workers=3)
+
+    def requested(self):
+        requested = sorted(self.server.requests)
+        del self.server.requests[:]
+        return requested
+
+    def test_first_download(self):
+        clean_md, entries = self.download()
+        self.assertEqual(sorted(month for month, etag in self.requested()), self.months)
+        self.assertEqual([(e['date'].year, e['date'].month) for e in entries], self.months)
+        self.assertEqual(len(m750.find_export_files(self.path)), len(self.months))
+        self.assertTrue(os.path.exists(os.path.join(self.path, m750.DOWNLOAD_STATE_FN)))
+
+    def test_refetch_current_month(self):
+        clean_md, entries = self.download()
+        self.requested()
+        current = self.months[-1]
+        fn = m750.export_filename(current[0], current[1], self.path)
+        with open(fn, mode='rb') as f:
+            saved = f.read()
+        clean_md2, entries2 = self.download()
+        # Only the current month is asked for again, and as it hasn't
+        # changed the server answers 304 Not Modified.
+        requested = self.requested()
+        self.assertEqual([month for month, etag in requested], [current])
+        self.assertTrue(requested[0][1])
+        with open(fn, mode='rb') as f:
+            self.assertEqual(f.read(), saved)
+        self.assertEqual(entries2, entries)
+
+    def test_resume(self):
+        # The first run is cut short: two months can't be downloaded.
+        failed = set(self.months[1:3])
+        self.server.down = set(failed)
+        clean_md, entries = self.download()
+        self.assertEqual(len(entries), len(self.months) - len(failed))
+        self.requested()
+        # The next run only asks for those two, and the current month.
+        self.server.down = set()
+        clean_md, entries = self.download()
+        expected = sorted(failed | set([self.months[-1]]))
+        self.assertEqual(sorted(set(month for month, etag in self.requested())), expected)
+        self.assertEqual([(e['date'].year, e['date'].month) for e in entries], self.months)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,26 @@
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from SocketServer import ThreadingMixIn
 try:
     import argparse
 except ImportError:
     argparse = None
+import cgi
 import datetime
-import glob
+import hashlib
 import os
 import pprint
 import re
 import sys
+import threading
 import time
+import urllib
 import urlparse
 import webbrowser
 
+import m750
+import search750
+
 try:
     import markdown2
 except ImportError:
@@ -20,8 +28,6 @@ except ImportError:
     markdown2 = None
 
 
-MONTHS = dict(zip(['NOTHING', 'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug',
-                   'sep', 'oct', 'nov', 'dec'], range(13)))
 HEAD = '''
 <html>
 <head>
@@ -326,12 +332,25 @@ button::-moz-focus-inner {
 <body>
 '''
 
+# Rendered HTML of each entry is kept in this folder (in the export folder)
+# with --cache-html; see fragment_cache.
+FRAGMENTS_DIR = '.m750-html'
+
+# Number of search results shown on each page.
+SEARCH_PAGE = 50
+
+SEARCH_FORM = '''\t<li><form action="/" method="get">
+\t<input type="hidden" name="view" value="search" />
+\t<input type="text" name="q" size="14" /> <input type="submit" value="Search" />
+\t</form></li>
+'''
+
 
 class TextServer(BaseHTTPRequestHandler):
+    # Keep connections open between requests (which needs Content-Length).
+    protocol_version = 'HTTP/1.1'
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
         path = self.path
         qs = {'view': 'entries'}
         if '?' in path:
@@ -346,10 +365,37 @@ class TextServer(BaseHTTPRequestHandler):
             keys = qs.get('metadata')
             func = self.server.get_metadata
             kwargs['keys'] = keys
-        self.wfile.write(func(*args, **kwargs))
+        if 'search' in qs.get('view', ()):
+            func = self.server.get_search
+            kwargs['query'] = qs.get('q', [''])[0]
+            start = qs.get('start', ['0'])[0]
+            kwargs['start'] = int(start) if start.isdigit() else 0
+        if 'concordance' in qs.get('view', ()):
+            func = self.server.get_concordance
+            kwargs['query'] = qs.get('q', [''])[0]
+        watcher = getattr(self.server, 'watcher', None)
+        try:
+            if watcher is None:
+                html = func(*args, **kwargs)
+            else:
+                html = watcher.model.page(func, *args, **kwargs)
+        except Exception as e:
+            self.send_error(500, str(e))
+            raise
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(html)))
+        self.end_headers()
+        self.wfile.write(html)
         return
 
 
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server which handles each connection in its own thread, so a
+    slow page doesn't hold up other requests.'''
+    daemon_threads = True
+
+
 def strip_pair(line):
     return ':'.join(line.split(':')[1:]).strip()
 
@@ -442,45 +488,10 @@ def parse_line_metadata(line):
     return flag, key, value, number
 
 
-def get_yeardate(fn):
-    name = os.path.basename(fn)
-    month = int(MONTHS[name[17:20]])
-    year = int(name[21:25])
-    return '%d-%02.0f' % (year, month)
-    
-
 def find_export_files(path):
     '''Find export files, discard smaller duplicates, sort by date,
-    and return list of filenames.'''
-    now = datetime.datetime.today()
-    fns = sorted(glob.glob(os.path.join(path, '750 Words-export-*')), key=get_yeardate)
-    if not len(fns):
-        return []
-    months_inv = dict([v, k] for k, v in MONTHS.items())
-    ym0 = get_yeardate(fns[0])
-    year, month = map(int, get_yeardate(fns[0]).split('-'))
-    fns1 = []
-    while year <= now.year:
-        if month > 12:
-            month = 1
-        if year == now.year:
-            condition = month <= now.month
-        else:
-            condition = True
-        while condition and month <= 12:
-            search = '750 Words-export-%s-%02.0f*' % (months_inv[month], year)
-            mfns = glob.glob(os.path.join(path, search))
-            max_size = -1
-            max_fn = None
-            for mfn in mfns:
-                if os.path.getsize(mfn) > max_size:
-                    max_size = os.path.getsize(mfn)
-                    max_fn = mfn
-            if max_fn:
-                fns1.append(max_fn)
-            month += 1
-        year += 1
-    return sorted(fns1, key=get_yeardate)
+    and return list of filenames (see m750.export_catalog).'''
+    return m750.find_export_files(path)
 
 
 def main():
@@ -503,6 +514,8 @@ def main():
         args = parser.parse_args(sys.argv[1:])
         port = int(args.port)
         path = args.path
+        if args.cache_html:
+            fragments.path = os.path.join(path, FRAGMENTS_DIR)
 
     class Call(object):
         def __init__(self, func, *args, **kwargs):
@@ -517,10 +530,14 @@ def main():
             return self.func(*a, **k)
 
     try:
-        server = HTTPServer(('', port), TextServer)
+        server = ThreadedHTTPServer(('', port), TextServer)
+        server.watcher = model_watcher(path)
+        server.watcher.start()
         server.get_html = Call(get_html, path=path)
         server.get_metadata_list = Call(get_metadata_list, path=path)
         server.get_metadata = Call(get_metadata, path=path)
+        server.get_search = Call(get_search, path=path)
+        server.get_concordance = Call(get_concordance, path=path)
         webbrowser.open('http://localhost:%d/' % port)
         server.serve_forever()
     except KeyboardInterrupt:
@@ -535,22 +552,161 @@ def get_cmdline_parser():
                         help='Folder containing 750 Words export files')
     parser.add_argument('-p', '--port', default='8984',
                         help='Port to start server on')
+    parser.add_argument('--cache-html', action='store_true',
+                        help='Keep the HTML of each entry in %s in the export '
+                             'folder, to start up faster next time' % FRAGMENTS_DIR)
     return parser
 
 
 def get_md_entries(path='.'):
-    raw_text = ''
-    for fn in find_export_files(path):
-        with open(fn, mode='r') as f:
-            raw_text += f.read()
-    cleaned_md, entries = parse_markdown(raw_text)
-    return raw_text, cleaned_md, entries
+    cleaned_md, entries = m750.parse_export_files(
+            find_export_files(path),
+            cache_fn=m750.default_cache_fn(path, parse_markdown),
+            parse_func=parse_markdown)
+    return cleaned_md, entries
+
+
+class entry_model(object):
+    '''The entries in the export files in *path*, parsed once and kept in
+    memory along with the pages made from them. Never changes once made;
+    model_watcher makes a new one when the export files change. Safe to
+    share between threads: a page asked for by several requests at once
+    is only made once.
+
+    Attributes:
+        - *fns*: export filenames
+        - *cleaned_md*, *entries*: as from get_md_entries
+        - *metadata*: as from get_metadatas
+
+    Methods:
+        - *page*
+        - *index*
+        - *concordance*
 
+    '''
+    max_pages = 100
+
+    def __init__(self, path='.', fns=None):
+        if fns is None:
+            fns = find_export_files(path)
+        self.path = path
+        self.fns = fns
+        self.cleaned_md, self.entries = m750.parse_export_files(
+                fns, cache_fn=m750.default_cache_fn(path, parse_markdown),
+                parse_func=parse_markdown)
+        self.metadata = get_metadatas(self.entries)
+        self.frames = {}
+        self.pages = OrderedDict()
+        self.search = {}
+        self.lock = threading.Lock()
+        self.making = {}
+        self.search_lock = threading.Lock()
+
+    def page(self, func, *args, **kwargs):
+        '''Return ``func(*args, model=self, **kwargs)``, making it only the
+        first time it is asked for. The *max_pages* most recently used
+        pages are kept.'''
+        name = getattr(func, 'func', func).__name__
+        key = repr((name, args, sorted(kwargs.items())))
+        while True:
+            with self.lock:
+                html = self.pages.pop(key, None)
+                if html is not None:
+                    self.pages[key] = html
+                    return html
+                making = self.making.get(key)
+                if making is None:
+                    making = self.making[key] = threading.Event()
+                    break
+            # Another thread is making this page; wait for it.
+            making.wait()
+        try:
+            html = func(*args, model=self, **kwargs)
+            with self.lock:
+                self.pages[key] = html
+                while len(self.pages) > self.max_pages:
+                    self.pages.popitem(last=False)
+        finally:
+            with self.lock:
+                del self.making[key]
+            making.set()
+        return html
+
+    def index(self):
+        '''Return the search750.text_index of the entries.'''
+        return self._search(search750.open_index)
+
+    def concordance(self):
+        '''Return the search750.concordance of the entries.'''
+        return self._search(search750.open_concordance)
+
+    def _search(self, open_func):
+        with self.search_lock:
+            if not open_func in self.search:
+                self.search[open_func] = open_func(self.path, self.entries,
+                                                   fns=self.fns)
+            return self.search[open_func]
+
+
+class model_watcher(object):
+    '''Keeps an entry_model of the export files in *path* up to date.
+
+    A background thread (see start) looks at the size and modification
+    time of the export files every *interval* seconds, and swaps in a new
+    model when any of them change, so requests only ever read *model*.
+
+    Methods:
+        - *check*
+        - *start*
 
-def get_entries_frame(path='.', frame_type='entries'):
-    raw_text, cleaned_md, entries = get_md_entries(path=path)
+    '''
+    def __init__(self, path='.', interval=2):
+        self.path = path
+        self.interval = interval
+        self.signature = None
+        self.model = None
+        self.check()
+
+    def check(self):
+        '''Make a new model if the export files have changed since the last
+        check. Returns True if they had.'''
+        fns = find_export_files(self.path)
+        signature = []
+        for fn in fns:
+            st = os.stat(fn)
+            signature.append((fn, st.st_size, st.st_mtime))
+        if signature == self.signature:
+            return False
+        self.model = entry_model(self.path, fns)
+        self.signature = signature
+        return True
+
+    def start(self):
+        '''Check for changes every *interval* seconds in a background
+        thread.'''
+        def watch():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    if self.check():
+                        print('Export files changed, entries reloaded')
+                except Exception as e:
+                    print('Could not reload entries (%s)' % e)
+        thread = threading.Thread(target=watch)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def get_entries_frame(path='.', frame_type='entries', model=None):
+    if model is None:
+        model = entry_model(path)
+    cleaned_md, entries = model.cleaned_md, model.entries
+    if frame_type in model.frames:
+        return model.frames[frame_type], cleaned_md, entries
     html = str(HEAD)
     html += '<div id="floating_sidebar">\n<ul>\n'
+    html += SEARCH_FORM
     if frame_type == 'entries':
         html += '\t<li><u><a href="/?view=entries">Entries</a></u> | <a href="/?view=metadata">Metadata</a></li><li></li>\n\n'
         for entry in entries:
@@ -560,34 +716,198 @@ def get_entries_frame(path='.', frame_type='entries'):
         html += '<li></li><li></li></ul></div>'
     elif frame_type == 'metadata':
         html += '\t<li><a href="/?view=entries">Entries</a> | <u><a href="/?view=metadata">Metadata</a></u></li><li></li>\n\n'
-        metadata = get_metadatas(entries)
+        metadata = model.metadata
         keys = sorted(metadata.keys())
         for key in keys:
             instances = sorted(metadata[key], key=lambda L: L[0])
             html += '\t<li><a href="%s">%s</a></li>' % ('/?view=metadata&metadata=' + key, key)
         html += '<li></li><li></li></ul></div>'
-    return html, raw_text, cleaned_md, entries
+    model.frames[frame_type] = html
+    return html, cleaned_md, entries
 
 
-def get_html(path='.'):
-    html, raw_text, cleaned_md, entries = get_entries_frame(path=path, frame_type='entries')
+def get_html(path='.', model=None):
+    html, cleaned_md, entries = get_entries_frame(path=path, frame_type='entries', model=model)
     html += '<h1>Entries</h1>\n\n'
+    html += render_markdown(cleaned_md, cache=fragments)
+    html += '\n</body></html>\n'
+    return html
+
+
+class FakeMarkdownParser(object):
+    # Fragments are converted separately and then joined with this.
+    joiner = ''
+
+    def convert(self, text):
+        return text.replace('\n', '\n<br />')
+
+
+def get_markdowner():
     if markdown2 is None:
-        class FakeMarkdownParser(object):
-            def convert(self, text):
-                return text.replace('\n', '\n<br />')
-        markdowner = FakeMarkdownParser()
-    else:
-        markdowner = markdown2.Markdown()
-    html += markdowner.convert(cleaned_md).encode('utf-8')
+        return FakeMarkdownParser()
+    markdowner = markdown2.Markdown()
+    markdowner.joiner = '\n'
+    return markdowner
+
+
+entry_start_re = re.compile(r'(?m)^<a id="\d{4}-\d{2}-\d{2}">$')
+
+
+def split_entries_md(cleaned_md):
+    '''Split the cleaned markdown from parse_markdown into one piece for
+    each entry (the first may also have anything before the first entry).'''
+    starts = [m.start() for m in entry_start_re.finditer(cleaned_md) if m.start()]
+    bounds = [0] + starts + [len(cleaned_md)]
+    return [cleaned_md[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def render_markdown(cleaned_md, cache=None):
+    '''Convert the cleaned markdown from parse_markdown to HTML one entry at
+    a time, re-using the HTML of entries already in *cache* (a
+    fragment_cache), so only new or changed entries are converted.
+
+    Returns: HTML encoded as UTF-8
+
+    '''
+    markdowner = get_markdowner()
+    fragments = []
+    for md in split_entries_md(cleaned_md):
+        if isinstance(md, unicode):
+            md = md.encode('utf-8')
+        key = hashlib.md5(type(markdowner).__name__ + '\0' + md).hexdigest()
+        html = None if cache is None else cache.get(key)
+        if html is None:
+            html = markdowner.convert(md)
+            if isinstance(html, unicode):
+                html = html.encode('utf-8')
+            if cache is not None:
+                cache.put(key, html)
+        fragments.append(html)
+    return markdowner.joiner.join(fragments)
+
+
+class fragment_cache(object):
+    '''Rendered HTML of entries, keyed by a hash of their markdown. The
+    *capacity* most recently used fragments are kept in memory, and if
+    *path* is set, every fragment is also saved as a file in that folder
+    so it survives restarts.
+
+    Methods:
+        - *get*
+        - *put*
+
+    '''
+    def __init__(self, capacity=5000, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the HTML for *key*, or None if it isn't cached.'''
+        with self.lock:
+            html = self.fragments.pop(key, None)
+            if html is not None:
+                self.fragments[key] = html
+                return html
+        if self.path:
+            try:
+                with open(os.path.join(self.path, key + '.html'), mode='rb') as f:
+                    html = f.read()
+            except IOError:
+                return None
+            self.put(key, html, save=False)
+        return html
+
+    def put(self, key, html, save=True):
+        '''Cache the HTML *html* for *key*.'''
+        with self.lock:
+            self.fragments.pop(key, None)
+            self.fragments[key] = html
+            while len(self.fragments) > self.capacity:
+                self.fragments.popitem(last=False)
+        if self.path and save:
+            fn = os.path.join(self.path, key + '.html')
+            tmp_fn = '%s.%d.tmp' % (fn, threading.current_thread().ident)
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                with open(tmp_fn, mode='wb') as f:
+                    f.write(html)
+                if os.path.exists(fn):
+                    os.remove(fn)
+                os.rename(tmp_fn, fn)
+            except (IOError, OSError) as e:
+                print('Warning: could not write %s (%s)' % (fn, e))
+
+
+fragments = fragment_cache()
+
+
+def get_search(query='', path='.', start=0, model=None):
+    if model is None:
+        model = entry_model(path)
+    html, cleaned_md, entries = get_entries_frame(path=path, frame_type='entries', model=model)
+    html += '<h1>Search</h1>\n\n'
+    if query.strip():
+        index = model.index()
+        # All the matches are ranked, so the total is right; only one page
+        # of them is shown.
+        results = index.search(query.decode('utf-8'), limit=None)
+        page = results[start:start + SEARCH_PAGE]
+        html += '<p>%d entries match <i>%s</i> (<a href="%s">in context</a>)' % (
+                    len(results), cgi.escape(query),
+                    '/?' + urllib.urlencode({'view': 'concordance', 'q': query}))
+        if page and len(page) < len(results):
+            html += '; showing %d-%d' % (start + 1, start + len(page))
+            if start + SEARCH_PAGE < len(results):
+                html += ' (<a href="%s">next</a>)' % ('/?' + urllib.urlencode(
+                            {'view': 'search', 'q': query,
+                             'start': start + SEARCH_PAGE}))
+        html += '</p>\n<ul>\n'
+        for result in page:
+            entry = entries[result['entry']]
+            html += '\t<li><a href="%s">%s</a>: %s</li>\n' % (
+                        '/?view=entries#%s' % entry['date'].strftime('%Y-%m-%d'),
+                        entry['date'].strftime('%a %d %b %Y'),
+                        index.snippet(entry['text'], result).encode('utf-8'))
+        html += '</ul>\n'
+    html += '\n</body></html>\n'
+    return html
+
+
+def get_concordance(query='', path='.', width=8, model=None):
+    if model is None:
+        model = entry_model(path)
+    html, cleaned_md, entries = get_entries_frame(path=path, frame_type='entries', model=model)
+    html += '<h1>Concordance</h1>\n\n'
+    if query.strip():
+        conc = model.concordance()
+        results = conc.kwic(query.decode('utf-8'), width=width)
+        html += '<p>%d occurrences of <i>%s</i></p>\n<table>\n' % (
+                    len(results), cgi.escape(query))
+        date = None
+        for result in results:
+            if result['date'] != date:
+                date = result['date']
+                html += '<tr><td colspan="3"><a href="%s">%s</a></td></tr>\n' % (
+                            '/?view=entries#%s' % date.strftime('%Y-%m-%d'),
+                            date.strftime('%a %d %b %Y'))
+            html += ('<tr><td align="right">%s</td><td><b>%s</b></td>'
+                     '<td>%s</td></tr>\n' % tuple(
+                        cgi.escape(result[key]).encode('utf-8')
+                        for key in ('left', 'match', 'right')))
+        html += '</table>\n'
     html += '\n</body></html>\n'
     return html
 
 
-def get_metadata_list(path='.'):
-    html, raw_text, cleaned_md, entries = get_entries_frame(path=path, frame_type='metadata')
+def get_metadata_list(path='.', model=None):
+    if model is None:
+        model = entry_model(path)
+    html, cleaned_md, entries = get_entries_frame(path=path, frame_type='metadata', model=model)
     html += '<h1>Metadata</h1>\n\n<ul>'
-    metadata = get_metadatas(entries)
+    metadata = model.metadata
     keys = sorted(metadata.keys())
     for key in keys:
         instances = sorted(metadata[key], key=lambda L: L[0])
@@ -649,9 +969,11 @@ def test_metadata_numeric(values):
     return twice, x, y
 
 
-def get_metadata(keys=(), path='.'):
-    html, raw_text, cleaned_md, entries = get_entries_frame(path=path, frame_type='metadata')
-    metadata = get_metadatas(entries)
+def get_metadata(keys=(), path='.', model=None):
+    if model is None:
+        model = entry_model(path)
+    html, cleaned_md, entries = get_entries_frame(path=path, frame_type='metadata', model=model)
+    metadata = model.metadata
     for key in keys:
         html += '<h2>' + key + '</h2>\n\n'
         flag, x, y = test_metadata_numeric(metadata[key])
@@ -684,11 +1006,7 @@ def get_metadata(keys=(), path='.'):
 
 
 def get_entries(path=r'U:\Downloads'):
-    md = ''
-    for fn in find_export_files(path):
-        with open(fn, mode='r') as f:
-            md += f.read()
-    md2, entries = parse_markdown(md)
+    md2, entries = get_md_entries(path=path)
     return entries
 
 if __name__ == '__main__':